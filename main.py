@@ -1,11 +1,20 @@
 import functools
+import json
+import sys
+from pathlib import Path
 from typing import Callable
 
 import click
 
-from src.split import Split
-from src.splice import Splice, NO_SILENCE
-from src.envelope import random_envs_to_file
+# NOTE: the processing modules (and numpy and scipy) are slow to import. they are imported by each command when it is run,
+# so that `--help` or a command only pays for the modules it uses. options are defined with the lightweight `src.constants`
+from src.constants import (
+    PRECISIONS, FORMATS, FORMAT_NATIVE, NO_SILENCE, PAN_LAWS, PAN_CONSTANT_POWER,
+    BENCHMARK_NAMES, BENCHMARK_DURATIONS, BENCHMARK_REPEAT, BENCHMARK_THRESHOLD,
+    SERVE_PORT, SERVE_QUEUE, SERVE_MAX_CORPORA
+)
+from src.utils.profile import start_profiling, stop_profiling
+from src.utils.validate import set_strict
 
 class IntOrStrType(click.ParamType):
     name = "int or str"
@@ -46,11 +55,84 @@ def common_options(func:Callable) -> Callable:
     return wrapper
 
 
+def dtype_options(func:Callable) -> Callable:
+    """
+    adds 2 options to define the dtype policy (see `src.track.DtypePolicy`):
+    - an option --precision that defines the float dtype used for processing
+    - an option --format that defines the sample format of the output files
+    """
+    @click.option(
+        "--precision",
+        type=click.Choice(PRECISIONS),
+        default="float32",
+        help="float dtype used to process the audio (default=float32)"
+    )
+    @click.option(
+        "--format", "format_",
+        type=click.Choice(FORMATS),
+        default=FORMAT_NATIVE,
+        help="sample format of the output files. if 'native', the sample format of the input files (default=native)"
+    )
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def seed_option(func:Callable) -> Callable:
+    """
+    adds an option --seed that seeds the random generator of a command, to make its output reproducible
+    """
+    @click.option(
+        "--seed",
+        type=click.IntRange(min=0),
+        default=None,
+        help="seed of the random generator. two runs with the same seed and inputs generate the same output. if not provided, the output is random"
+    )
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    return wrapper
+
+
 @click.group()
-def cli():
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="record the wall time and peak memory of each processing stage (read, resample, channel conversion, chunk positioning, envelope, mix, write) and print them to stderr as json when the command ends"
+)
+@click.option(
+    "--profile-out",
+    type=click.STRING,
+    default=None,
+    help="write the profile to this json file instead of stderr. implies '--profile'"
+)
+@click.option(
+    "--strict",
+    is_flag=True,
+    default=False,
+    help="validate inputs everywhere, including internal calls that are trusted to be valid. slower, useful to debug (default=False: inputs are validated once, when they are passed to a command)"
+)
+@click.pass_context
+def cli(ctx, profile, profile_out, strict):
     """
     command line interface for aura
     """
+    set_strict(strict)
+    if profile or profile_out is not None:
+        start_profiling()
+        ctx.call_on_close(lambda: write_profile(ctx.invoked_subcommand, profile_out))
+
+
+def write_profile(command: str|None, outpath: str|None) -> None:
+    """stop profiling and write the profile of `command` to `outpath`, or to stderr if `outpath` is None"""
+    report = { "command": command, **stop_profiling() }
+    if outpath is not None:
+        from src.utils.io_op import write_json
+        write_json(outpath, report)
+    else:
+        print(json.dumps(report, indent=2), file=sys.stderr)
 
 
 @cli.command()
@@ -59,16 +141,19 @@ def cli():
     type=click.INT,
     required=True
 )
+@seed_option
 @common_options
 def envelope(
     n_env: int,
+    seed: int|None,
     outpath: str,
     overwrite: bool
 ):
     """
     generate `n_env` random envelopes and write them to `outpath`
     """
-    random_envs_to_file(n_env, outpath, overwrite)
+    from src.envelope import random_envs_to_file
+    random_envs_to_file(n_env, outpath, overwrite, seed)
 
 
 @cli.command()
@@ -100,6 +185,25 @@ def envelope(
     default=None,
     help="number of channels in output tracks (1=mono, 2=stereo). if None, same as number of channels in input track"
 )
+@click.option(
+    "--mmap/--no-mmap",
+    default=True,
+    help="memory-map the input track instead of loading it in RAM (default=True)"
+)
+@click.option(
+    "-j", "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    help="number of threads used to write the chunks (default=4)"
+)
+@click.option(
+    "-P", "--processes",
+    type=click.IntRange(min=1),
+    default=1,
+    help="number of processes used to split several tracks in parallel. no effect if 'trackpath' is a single file (default=1)"
+)
+@dtype_options
+@seed_option
 @common_options
 def split(
     trackpath,
@@ -108,20 +212,63 @@ def split(
     dev,
     nchunks,
     nchannels,
+    mmap,
+    workers,
+    processes,
+    precision,
+    format_,
+    seed,
     overwrite
 ):
     """
-    command line interface for aura.split: generate `nchunks` random chunks of `length` seconds (+/- `dev` standard deviation) from track `trackpath` and write them to `output`
+    command line interface for aura.split: generate `nchunks` random chunks of `length` seconds (+/- `dev` standard deviation) from track `trackpath` and write them to `output`.
+    `trackpath` can be a file, a directory or a glob pattern (quoted, e.g. 'archive/**/*.wav'): all matching tracks are split into `output`.
     """
-    Split(
-        trackpath=trackpath,
-        outpath=outpath,
+    from src.split import Split, split_many
+    kwargs = dict(
         length=length,
         dev=dev,
         nchunks=nchunks,
         nchannels=nchannels,
-        overwrite=overwrite
-    ).pipeline()
+        mmap=mmap,
+        nworkers=workers,
+        precision=precision,
+        format_=format_
+    )
+    if Path(trackpath).is_file():
+        split = Split(trackpath=trackpath, outpath=outpath, overwrite=overwrite, seed=seed, **kwargs).pipeline()
+        failed = len(split.write_errors) > 0
+    else:
+        summaries = split_many(trackpath, outpath, overwrite, processes, seed, **kwargs)
+        failed = any( "error" in s or len(s["write_errors"]) for s in summaries )
+    if failed:
+        exit(1)
+
+
+@cli.command()
+@click.argument(
+    "trackspath",
+    type=click.STRING,
+    required=True
+)
+@click.option(
+    "-c", "--nchannels",
+    type=click.Choice([1,2]),
+    default=1,
+    help="number of channels of the chunks in the output bank (1=mono, 2=stereo). 'aura splice' uses mono chunks (default=1)"
+)
+@common_options
+def bank(
+    trackspath,
+    outpath,
+    nchannels,
+    overwrite
+):
+    """
+    pack all sound files in `trackspath` into a chunk bank written to directory `outpath`: a single memory-mapped sample file and an index of chunk positions. the output can be used as the `trackspath` of `aura splice`.
+    """
+    from src.corpus import tracks_to_bank
+    tracks_to_bank(trackspath, outpath, nchannels, overwrite)
 
 
 @cli.command()
@@ -133,8 +280,8 @@ def split(
 @click.option(
     "-l", "--length",
     type=click.INT,
-    required=True,
-    help="length of output track in seconds"
+    default=None,
+    help="length of output track in seconds. required, unless '--plan' is provided"
 )
 @click.option(
     "-i", '--nimpulses',
@@ -167,6 +314,12 @@ def split(
     default=2,
     help="how to place the chunks in stereo space (no effect if 'nchannels==1'). if 'mode=2', chunks will be hard-panned (placed either on the left or right channel) ; if 'mode==3', chunks will be placed in left, right and center of stereo space ; if 'range', chunks will be placed randomly in the stereo space."
 )
+@click.option(
+    "--pan-law",
+    type=click.Choice(PAN_LAWS),
+    default=PAN_CONSTANT_POWER,
+    help=f"how the volume of a chunk is split between the left and right channels (no effect if 'nchannels==1'). '{PAN_CONSTANT_POWER}' keeps the same loudness at all positions ; 'linear' keeps the sum of both channels constant (default={PAN_CONSTANT_POWER})"
+)
 @click.option(
     "-p", "--pattern",
     type=click.STRING,
@@ -178,6 +331,44 @@ def split(
     default=10,
     help="interval in seconds at which to repeat 'pattern'. must be shorter than 'pattern''s length"
 )
+@click.option(
+    "-b", "--block",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="render and write the output track in blocks of 'block' seconds, to use a constant amount of memory. if not provided, the output track is rendered in memory."
+)
+@click.option(
+    "--cache-dir",
+    type=click.STRING,
+    default=None,
+    help="directory in which to cache the decoded and normalized chunks of 'trackspath', to speed up later runs on the same chunks. if not provided, no cache is used."
+)
+@click.option(
+    "-V", "--variants",
+    type=click.IntRange(min=1),
+    default=1,
+    help="number of variants to render. variants only differ by their random decisions: the chunks are loaded once and shared by all variants, and each variant is written to a numbered output path ('out.wav' => 'out_1.wav', 'out_2.wav'...) (default=1)"
+)
+@click.option(
+    "-P", "--processes",
+    type=click.IntRange(min=1),
+    default=None,
+    help="number of processes used to render the variants in parallel. no effect if 'variants==1' (default=number of CPUs)"
+)
+@click.option(
+    "--plan",
+    type=click.STRING,
+    default=None,
+    help="path to a plan saved with '--save-plan'. the plan is rendered again, without redrawing its random decisions: '--length', '--nimpulses', '--envelope', '--nchannels', '--width', '--mode', '--pan-law' and '--seed' are ignored. no effect if 'variants>1'"
+)
+@click.option(
+    "--save-plan",
+    type=click.STRING,
+    default=None,
+    help="save the plan of the output track (the position, chunk, envelope and stereo gains of each impulse) to this path, as an npz file. no effect if 'variants>1'"
+)
+@dtype_options
+@seed_option
 @common_options
 def splice(
     trackspath,
@@ -188,26 +379,180 @@ def splice(
     nchannels,
     width,
     mode,
+    pan_law,
     pattern,
     repeat,
+    block,
+    cache_dir,
+    variants,
+    processes,
+    plan,
+    save_plan,
+    precision,
+    format_,
+    seed,
     overwrite
 ):
     """
     command line interface for aura.splice: generate a track of `length` seconds by playing chunks in `trackspath` randomly `nimpulses` times and write it to `outpath`. it is possible to apply envelopes to the tracks, place them in stereo space, add a repeating pattern...
     """
-    Splice(
-        trackspath=trackspath,
-        outpath=outpath,
+    from src.splice import Splice, splice_variants
+    kwargs = dict(
         length=length,
         nimpulses=nimpulses,
         envelope=envelope,
         nchannels=nchannels,
         width=width,
         mode=mode,
+        pan_law=pan_law,
         pattern=pattern,
         repeat=repeat,
-        overwrite=overwrite
-    ).pipeline()
+        block=block,
+        precision=precision,
+        format_=format_
+    )
+    if variants == 1:
+        splice_ = Splice(
+            trackspath=trackspath,
+            outpath=outpath,
+            overwrite=overwrite,
+            cache_dir=cache_dir,
+            seed=seed,
+            plan=plan,
+            **kwargs
+        )
+        plan_ = splice_.get_plan()
+        if save_plan is not None:
+            plan_.save(save_plan, overwrite)
+        splice_.pipeline(plan_)
+    elif plan is not None or save_plan is not None:
+        print("'--plan' and '--save-plan' can only be used to render a single variant ('variants==1')")
+        exit(1)
+    else:
+        summaries = splice_variants(trackspath, outpath, variants, processes, seed, overwrite, cache_dir, **kwargs)
+        if any( "error" in s for s in summaries ):
+            exit(1)
+
+
+@cli.command()
+@click.option(
+    "-b", "--benchmark", "names",
+    type=click.Choice(BENCHMARK_NAMES),
+    multiple=True,
+    help="benchmark to run. can be repeated. if not provided, all benchmarks are run"
+)
+@click.option(
+    "-d", "--duration", "durations",
+    type=click.FloatRange(min=0, min_open=True),
+    multiple=True,
+    default=BENCHMARK_DURATIONS,
+    help=f"duration of the synthetic input tracks, in seconds. can be repeated (default={list(BENCHMARK_DURATIONS)})"
+)
+@click.option(
+    "-r", "--repeat",
+    type=click.IntRange(min=1),
+    default=BENCHMARK_REPEAT,
+    help=f"number of timed runs of each benchmark (default={BENCHMARK_REPEAT})"
+)
+@click.option(
+    "--baseline",
+    type=click.STRING,
+    default=None,
+    help="path to the json results of a previous run. if provided, the results are compared with it, and the command fails if there are regressions"
+)
+@click.option(
+    "-t", "--threshold",
+    type=click.FloatRange(min=0),
+    default=BENCHMARK_THRESHOLD,
+    help=f"relative slowdown compared to 'baseline' above which a benchmark is a regression (default={BENCHMARK_THRESHOLD})"
+)
+@common_options
+def bench(
+    names,
+    durations,
+    repeat,
+    baseline,
+    threshold,
+    outpath,
+    overwrite
+):
+    """
+    run the benchmarks of aura's main processing steps on synthetic tracks and write the timings to `outpath` as json. the output can be used as the `baseline` of later runs.
+    """
+    from src import benchmark
+    regressions = benchmark.pipeline(
+        outpath=outpath,
+        overwrite=overwrite,
+        baseline=baseline,
+        threshold=threshold,
+        names=list(names) if len(names) else None,
+        durations=tuple(durations),
+        repeat=repeat
+    )
+    if len(regressions):
+        exit(1)
+
+
+@cli.command()
+@click.option(
+    "-p", "--port",
+    type=click.IntRange(min=1, max=65535),
+    default=SERVE_PORT,
+    help=f"localhost port on which jobs are received (default={SERVE_PORT}). unused if '--socket' is provided"
+)
+@click.option(
+    "-s", "--socket", "socket_path",
+    type=click.STRING,
+    default=None,
+    help="path to a unix socket on which jobs are received, instead of a localhost port"
+)
+@click.option(
+    "-j", "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="number of jobs run at once (defaults to the number of CPUs)"
+)
+@click.option(
+    "-q", "--queue",
+    type=click.IntRange(min=0),
+    default=SERVE_QUEUE,
+    help=f"maximum number of jobs waiting for a worker. jobs received when the queue is full are rejected (default={SERVE_QUEUE})"
+)
+@click.option(
+    "--preload",
+    type=click.STRING,
+    multiple=True,
+    help="corpus directory to load before accepting jobs. can be repeated"
+)
+@click.option(
+    "--max-corpora",
+    type=click.IntRange(min=1),
+    default=SERVE_MAX_CORPORA,
+    help=f"maximum number of corpora kept resident. the least recently used corpus is evicted first (default={SERVE_MAX_CORPORA})"
+)
+@click.option(
+    "--token",
+    type=click.STRING,
+    envvar="AURA_SERVE_TOKEN",
+    default=None,
+    help="if provided, requests must send the header 'Authorization: Bearer <token>'. can also be set with the environment variable AURA_SERVE_TOKEN"
+)
+def serve(
+    port,
+    socket_path,
+    workers,
+    queue,
+    preload,
+    max_corpora,
+    token
+):
+    """
+    run a render daemon that keeps the decoded corpora resident and runs split and splice jobs received as json over http.
+
+    POST the parameters of a job to `/split` or `/splice` as 'application/json'; GET `/status` to list the workers and resident corpora.
+    """
+    from src.serve import serve as serve_
+    serve_(port, socket_path, workers, queue, list(preload), max_corpora, token)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,289 @@
+from typing import Callable, Dict, List, Tuple, Any
+from pathlib import Path
+import statistics
+import itertools
+import tempfile
+import subprocess
+import platform
+import time
+import sys
+
+import numpy as np
+
+from src.track import Track, TrackList
+from src.envelope import Envelope
+from src.split import Split
+from src.splice import Splice
+from src.utils.io_op import write_wav, read_wav_from_dir, make_dir, read_json, write_json, check_exists_file
+from src.constants import (
+    NO_SILENCE,
+    BENCHMARK_NAMES,
+    BENCHMARK_DURATIONS as DURATIONS,  # durations (in seconds) of the fixtures
+    BENCHMARK_REPEAT as REPEAT,  # number of timed runs of each benchmark. the fastest run is used for comparisons
+    BENCHMARK_THRESHOLD as THRESHOLD  # relative slowdown above which a benchmark is considered a regression
+)
+
+# default fixtures: every combination of durations, rates and number of channels
+RATES = (44100, 48000)
+NCHANNELS = (1, 2)
+CORPUS_SIZE = 20  # number of chunks in the corpus used by the splice benchmarks
+CHUNK_LENGTH = 1.  # length of the chunks in the split and splice benchmarks (in seconds)
+
+
+def make_signal(seconds: float, rate: int, nchannels: int, seed: int = 0) -> np.ndarray:
+    """
+    generate a synthetic 16-bit PCM signal: a sine wave with added noise, so that the signal
+    is neither silent nor trivially compressible.
+
+    :returns: an array of shape (nframes,) (mono) or (nframes, nchannels)
+    """
+    rng = np.random.default_rng(seed)
+    nframes = int(seconds * rate)
+    t = np.arange(nframes) / rate
+    signal = 0.5 * np.sin(2 * np.pi * 440 * t) + 0.1 * rng.standard_normal(nframes)
+    if nchannels > 1:
+        signal = np.repeat(signal[:, np.newaxis], nchannels, axis=1)
+    return np.clip(signal * 32767, -32768, 32767).astype(np.int16)
+
+
+def make_fixture(dp: Path, seconds: float, rate: int, nchannels: int, seed: int = 0) -> Path:
+    """write a synthetic signal (see `make_signal`) to a wav file in directory `dp`"""
+    fp = dp.joinpath(f"{fixture_name(seconds, rate, nchannels)}_{seed}.wav")
+    write_wav(fp, rate, make_signal(seconds, rate, nchannels, seed))
+    return fp
+
+
+def fixture_name(seconds: float, rate: int, nchannels: int) -> str:
+    return f"{seconds:g}s_{rate}hz_{nchannels}ch"
+
+
+def timeit(func: Callable[[], Any], setup: Callable[[], Any]|None = None, repeat: int = REPEAT) -> Dict[str, float|int]:
+    """
+    time `repeat` runs of `func`. if provided, `setup` is run before each run, and is not timed.
+
+    :returns: the min, median and max duration of the runs (in seconds) and the number of runs
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return { "min": min(times), "median": statistics.median(times), "max": max(times), "repeat": repeat }
+
+
+def bench_import(fixtures: List[Tuple[Tuple, Path]], tmp: Path, repeat: int) -> Dict[str, Dict]:
+    """
+    time the startup of the command line interface and the import of the processing modules, each in a new interpreter.
+    the startup of an empty interpreter is timed too, as a reference
+    """
+    root = Path(__file__).resolve().parents[1]
+    main = str(root.joinpath("main.py"))
+    commands = {
+        "python": [ "-c", "pass" ],
+        "cli_help": [ main, "--help" ],
+        "cli_envelope": [ main, "envelope", "10", "-o", str(tmp.joinpath("envelopes.jsonl")), "-W" ],
+        **{ module: [ "-c", f"import {module}" ] for module in ("src.track", "src.envelope", "src.split", "src.splice") }
+    }
+    return {
+        name: timeit(lambda: subprocess.run([ sys.executable, *args ], cwd=root, check=True, capture_output=True), repeat=repeat)
+        for name, args in commands.items()
+    }
+
+
+def bench_envelope_apply(fixtures: List[Tuple[Tuple, Path]], tmp: Path, repeat: int) -> Dict[str, Dict]:
+    """time `Envelope.apply` on a whole track"""
+    results = {}
+    envelope = Envelope(a=1, a_t=0.1, d=0.7, d_t=0.3, s_t=0.8)
+    for (seconds, rate, nchannels), fp in fixtures:
+        source = Track.read(fp)
+        state = {}
+        results[fixture_name(seconds, rate, nchannels)] = timeit(
+            lambda: envelope.apply(state["track"]),
+            setup=lambda: state.update(track=source.copy()),
+            repeat=repeat
+        )
+    return results
+
+
+def bench_split_pipeline(fixtures: List[Tuple[Tuple, Path]], tmp: Path, repeat: int) -> Dict[str, Dict]:
+    """time `Split.pipeline`, from reading the track to writing the chunks, with and without standard deviation"""
+    results = {}
+    for (seconds, rate, nchannels), fp in fixtures:
+        # tracks shorter than `CHUNK_LENGTH` are split into chunks of half their duration
+        length = CHUNK_LENGTH if seconds >= CHUNK_LENGTH else seconds / 2
+        for dev in (0., length / 4):
+            outpath = tmp.joinpath("split")
+            results[f"{fixture_name(seconds, rate, nchannels)}_dev{dev:g}"] = timeit(
+                lambda: Split(str(fp), str(outpath), length, dev=dev, overwrite=True, seed=0).pipeline(),
+                repeat=repeat
+            )
+    return results
+
+
+def bench_tracklist_resample(fixtures: List[Tuple[Tuple, Path]], tmp: Path, repeat: int) -> Dict[str, Dict]:
+    """time `TrackList.resample` on pairs of tracks with different rates"""
+    results = {}
+    rates = sorted(set( rate for (_, rate, _), _ in fixtures ))
+    for (seconds, rate, nchannels), fp in fixtures:
+        # only the tracks at the lowest rate need resampling
+        if len(rates) < 2 or rate != rates[0]:
+            continue
+        other = next( f for (s, r, c), f in fixtures if (s, r, c) == (seconds, rates[-1], nchannels) )
+        sources = [ Track.read(fp), Track.read(other) ]
+        state = {}
+        results[f"{fixture_name(seconds, rate, nchannels)}_to_{rates[-1]}hz"] = timeit(
+            # `TrackList` resamples its tracks when it is created
+            lambda: TrackList(state["tracks"]),
+            setup=lambda: state.update(tracks=[ t.copy() for t in sources ]),
+            repeat=repeat
+        )
+    return results
+
+
+def bench_read_wav_from_dir(fixtures: List[Tuple[Tuple, Path]], tmp: Path, repeat: int) -> Dict[str, Dict]:
+    """time `read_wav_from_dir` on a directory containing all fixtures of the same duration"""
+    results = {}
+    for seconds, group in itertools.groupby(sorted(fixtures, key=lambda f: f[0]), key=lambda f: f[0][0]):
+        group = list(group)
+        dp = make_dir(tmp.joinpath(f"dir_{seconds:g}s"), overwrite=True)
+        for _, fp in group:
+            dp.joinpath(fp.name).symlink_to(fp)
+        results[f"{seconds:g}s_x{len(group)}"] = timeit(lambda: read_wav_from_dir(dp), repeat=repeat)
+    return results
+
+
+def bench_splice_pipeline(fixtures: List[Tuple[Tuple, Path]], tmp: Path, repeat: int) -> Dict[str, Dict]:
+    """time `Splice.pipeline` on a corpus of short chunks at mixed rates, for each output duration"""
+    results = {}
+    rates = sorted(set( rate for (_, rate, _), _ in fixtures ))
+    corpus = make_dir(tmp.joinpath("corpus"), overwrite=True)
+    for i in range(CORPUS_SIZE):
+        make_fixture(corpus, CHUNK_LENGTH, rates[i % len(rates)], 1, seed=i)
+    outpath = tmp.joinpath("splice.wav")
+    for seconds in sorted(set( seconds for (seconds, _, _), _ in fixtures )):
+        for nimpulses, envelope in ((NO_SILENCE, None), (int(seconds * 10), "random")):
+            results[f"{seconds:g}s_{nimpulses}_env-{envelope}"] = timeit(
+                lambda: Splice(corpus, outpath, seconds, nimpulses, envelope, overwrite=True, seed=0).pipeline(),
+                repeat=repeat
+            )
+    return results
+
+
+# benchmark name => benchmark function. each function returns { <case name>: <timings> }
+BENCHMARKS: Dict[str, Callable[[List[Tuple[Tuple, Path]], Path, int], Dict[str, Dict]]] = {
+    "import": bench_import,
+    "envelope_apply": bench_envelope_apply,
+    "split_pipeline": bench_split_pipeline,
+    "tracklist_resample": bench_tracklist_resample,
+    "read_wav_from_dir": bench_read_wav_from_dir,
+    "splice_pipeline": bench_splice_pipeline,
+}
+assert list(BENCHMARKS.keys()) == BENCHMARK_NAMES, "the names of the benchmarks should be listed in `src.constants`"
+
+
+def run_benchmarks(
+    names: List[str]|None = None,
+    durations: Tuple[float, ...] = DURATIONS,
+    rates: Tuple[int, ...] = RATES,
+    nchannels: Tuple[int, ...] = NCHANNELS,
+    repeat: int = REPEAT
+) -> Dict[str, Any]:
+    """
+    run the benchmarks on synthetic fixtures, written to a temporary directory that is removed afterwards.
+
+    :param names: names of the benchmarks to run (see `BENCHMARKS`). if None, all benchmarks are run
+    :param durations: durations of the fixtures (in seconds)
+    :param rates: sampling rates of the fixtures
+    :param nchannels: number of channels of the fixtures
+    :param repeat: number of timed runs of each benchmark
+    :returns: { "meta": <environment and parameters>, "results": { <benchmark name>: { <case name>: <timings> } } }
+    """
+    names = list(BENCHMARKS.keys()) if names is None else names
+    unknown = [ n for n in names if n not in BENCHMARKS ]
+    if len(unknown):
+        raise ValueError(f"unknown benchmarks: {unknown}. expected one of {list(BENCHMARKS.keys())}")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="aura_bench_") as tmp:
+        tmp = Path(tmp)
+        fixtures_dir = make_dir(tmp.joinpath("fixtures"), overwrite=True)
+        fixtures = [
+            ((seconds, rate, nch), make_fixture(fixtures_dir, seconds, rate, nch))
+            for seconds, rate, nch in itertools.product(durations, rates, nchannels)
+        ]
+        for name in names:
+            results[name] = BENCHMARKS[name](fixtures, tmp, repeat)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "durations": list(durations),
+            "rates": list(rates),
+            "nchannels": list(nchannels),
+            "repeat": repeat,
+        },
+        "results": results
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    compare benchmark results with a baseline (both in the format returned by `run_benchmarks`).
+    the fastest runs are compared: they are the least affected by noise from other processes.
+    cases that are not in both `results` and `baseline` are ignored.
+
+    :param threshold: relative slowdown above which a case is a regression (0.2 = 20% slower than the baseline)
+    :returns: a comparison of each case, with a `regression` flag
+    """
+    comparison = []
+    for name, cases in results["results"].items():
+        for case, timings in cases.items():
+            base = baseline["results"].get(name, {}).get(case)
+            if base is None:
+                continue
+            ratio = timings["min"] / base["min"] if base["min"] > 0 else float("inf")
+            comparison.append({
+                "benchmark": name,
+                "case": case,
+                "baseline": base["min"],
+                "current": timings["min"],
+                "ratio": ratio,
+                "regression": ratio > 1 + threshold
+            })
+    return comparison
+
+
+def pipeline(
+    outpath: str|Path,
+    overwrite: bool = False,
+    baseline: str|Path|None = None,
+    threshold: float = THRESHOLD,
+    **kwargs
+) -> List[Dict[str, Any]]:
+    """
+    run the benchmarks, write the results to `outpath` as json and compare them with `baseline`, if provided.
+    the results of a run can be used as the baseline of later runs.
+
+    :param kwargs: parameters passed to `run_benchmarks`
+    :returns: the regressions (see `compare`)
+    """
+    outpath, _ = check_exists_file(outpath, overwrite)
+    baseline_data = read_json(baseline) if baseline is not None else None  # read it first, in case `baseline == outpath`
+    results = run_benchmarks(**kwargs)
+    write_json(outpath, results)
+
+    for name, cases in results["results"].items():
+        for case, timings in cases.items():
+            print(f"{name:<20} {case:<32} {timings['min']*1000:>10.2f}ms (median: {timings['median']*1000:.2f}ms)")
+    if baseline_data is None:
+        return []
+
+    comparison = compare(results, baseline_data, threshold)  # pyright: ignore
+    regressions = [ c for c in comparison if c["regression"] ]
+    print(f"\ncompared {len(comparison)} cases with baseline '{baseline}': {len(regressions)} regressions (threshold: +{threshold:.0%})")
+    for c in regressions:
+        print(f"- {c['benchmark']} {c['case']}: {c['baseline']*1000:.2f}ms -> {c['current']*1000:.2f}ms (x{c['ratio']:.2f})")
+    return regressions
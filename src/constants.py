@@ -0,0 +1,36 @@
+"""
+constants shared by the command line interface and the processing modules.
+
+this module has no dependencies, so that the command line interface can define its options
+without importing the processing modules (and numpy and scipy) until a command is run.
+"""
+
+# resampling backends (see `src.track.Track.resample`)
+RESAMPLE_POLY = "polyphase"
+RESAMPLE_FFT = "fft"
+
+# dtype policy (see `src.track.DtypePolicy`)
+FORMAT_NATIVE = "native"
+PRECISIONS = ["float32", "float64"]
+FORMATS = [FORMAT_NATIVE, "uint8", "int16", "int32", "float32", "float64"]
+
+# splice strategies (see `src.splice.Splice`)
+NO_SILENCE = "no-silence"
+ENV_RANDOM = "random"
+ENV_NONE = None
+# pan laws (see `src.splice.pan_gains`)
+PAN_CONSTANT_POWER = "constant-power"
+PAN_LINEAR = "linear"
+PAN_LAWS = [PAN_CONSTANT_POWER, PAN_LINEAR]
+
+# benchmarks (see `src.benchmark`)
+BENCHMARK_NAMES = ["import", "envelope_apply", "split_pipeline", "tracklist_resample", "read_wav_from_dir", "splice_pipeline"]
+BENCHMARK_DURATIONS = (1., 10., 60.)
+BENCHMARK_REPEAT = 5
+BENCHMARK_THRESHOLD = 0.2
+
+# render daemon (see `src.serve`)
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8765
+SERVE_QUEUE = 16
+SERVE_MAX_CORPORA = 4  # maximum number of corpora kept resident. the least recently used corpus is evicted first
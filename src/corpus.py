@@ -0,0 +1,289 @@
+from typing import List, Literal, Dict
+from pathlib import Path
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from src.track import Track, TrackList, DtypePolicy, DEFAULT_POLICY, RESAMPLE_POLY
+from src.utils.io_op import fp_to_abs, list_wav_dir, read_wav_rate, read_json, write_json, make_dir
+from src.utils.parallel import thread_map_bounded
+from src.utils.utils import lengths_to_offsets, make_rng, Seed
+
+
+class CorpusCache:
+
+    cache_dir: Path
+
+    def __init__(self, cache_dir: str|Path):
+        """
+        persistent on-disk cache of decoded and normalized corpora (directories of sound files).
+
+        each sound file is decoded, resampled and converted to the requested number of channels once,
+        and the result is stored in `cache_dir` as a `.npy` file that is memory-mapped on later reads.
+
+        cache entries are keyed by file path, size and modification time, target rate, number of channels
+        and resampling method: when a source file changes, its key changes, and the stale entry is replaced.
+        entries of the same file with other parameters (rate, channels...) are kept.
+
+        :param cache_dir: path to the cache directory. created if it does not exist.
+        """
+        self.cache_dir = fp_to_abs(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def path_id(fp: Path) -> str:
+        """identifier of a source file, independent of its contents"""
+        return hashlib.sha1(str(fp).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def key(fp: Path, rate: int, nchannels: int, method: str, precision: np.dtype) -> str:
+        """
+        identifier of a normalized version of the current contents of a source file, as `{params}_{contents}`:
+        `params` identifies the normalization, `contents` identifies the size and modification time of the file
+        """
+        stat = fp.stat()
+        params = json.dumps([ str(fp), rate, nchannels, method, precision.str ])
+        contents = json.dumps([ stat.st_size, stat.st_mtime_ns ])
+        return f"{hashlib.sha1(params.encode()).hexdigest()[:16]}_{hashlib.sha1(contents.encode()).hexdigest()[:16]}"
+
+    def entry_path(self, fp: Path, key: str) -> Path:
+        """path to the cache entry (without extension)"""
+        return self.cache_dir.joinpath(f"{self.path_id(fp)}_{key}")
+
+    def get(self, fp: Path, key: str, policy: DtypePolicy = DEFAULT_POLICY) -> Track|None:
+        """
+        read a cache entry. the data is memory-mapped and read-only.
+        :returns: the cached track, or None if the entry is not cached
+        """
+        entry = self.entry_path(fp, key)
+        # the metadata file is written last: if it exists, the entry is complete
+        if not entry.with_suffix(".json").exists():
+            return None
+        meta: Dict = read_json(entry.with_suffix(".json"))  # pyright: ignore
+        data = np.load(entry.with_suffix(".npy"), mmap_mode="r")
+        return Track(meta["rate"], data, fp, policy, np.dtype(meta["dtype"]))
+
+    def put(self, fp: Path, key: str, track: Track) -> None:
+        """
+        write a cache entry and remove the stale entries of the same source file: the entries with the same
+        normalization parameters, made from previous contents of the file. temporary files are never removed,
+        since they may belong to another process writing an entry.
+        """
+        entry = self.entry_path(fp, key)
+        params = key.split("_")[0]
+        for stale in self.cache_dir.glob(f"{self.path_id(fp)}_{params}_*"):
+            if stale.suffix in (".npy", ".json") and stale.name.split(".")[0] != entry.name:
+                stale.unlink(missing_ok=True)
+        # write to temporary files and rename them, so that concurrent readers never see partial entries
+        tmp_npy = entry.with_name(f"{entry.name}.npy.{os.getpid()}.tmp")
+        tmp_json = entry.with_name(f"{entry.name}.json.{os.getpid()}.tmp")
+        with open(tmp_npy, mode="wb") as fh:
+            np.save(fh, np.ascontiguousarray(track.get_data()))
+        os.replace(tmp_npy, entry.with_suffix(".npy"))
+        write_json(tmp_json, { "source": str(fp), "rate": track.rate, "dtype": track.native_dtype.str })
+        os.replace(tmp_json, entry.with_suffix(".json"))
+
+    def read_dir(
+        self,
+        dp: str|Path,
+        nchannels: int = 1,
+        method: Literal["polyphase", "fft"] = RESAMPLE_POLY,
+        nworkers: int|None = None,
+        policy: DtypePolicy = DEFAULT_POLICY,
+        rng: Seed = None
+    ) -> TrackList:
+        """
+        read all sound files in `dp`, resampled to the highest rate among these files and converted
+        to `nchannels` channels. files that are not cached are decoded, normalized and cached.
+
+        :param dp: path to the directory
+        :param nchannels: number of channels (1=mono, 2=stereo)
+        :param method: resampling backend (see `Track.resample`)
+        :param nworkers: number of threads used to process the files that are not cached
+        :param policy: dtypes used to process the tracks (see `DtypePolicy`)
+        :param rng: random generator or seed used to pick tracks (see `TrackList`)
+        """
+        nworkers = (os.cpu_count() or 1) if nworkers is None else nworkers
+        fp_list = list_wav_dir(dp)
+        if not len(fp_list):
+            raise ValueError(f"directory should contain at least one sound file (directory='{dp}')")
+        # the target rate is read from the headers of the files, without decoding them
+        rate = max(read_wav_rate(fp) for fp in fp_list)
+
+        def load(fp: Path) -> Track:
+            key = self.key(fp, rate, nchannels, method, policy.precision)
+            cached = self.get(fp, key, policy)
+            if cached is not None:
+                return cached
+            track = Track.read(fp, policy=policy)
+            track.resample(rate, method).set_nchannels(nchannels)
+            self.put(fp, key, track)
+            return track
+
+        tracks: List[Track] = []
+        for fp, track, error in thread_map_bounded(load, fp_list, nworkers):
+            if error is None:
+                tracks.append(track)  # pyright: ignore
+            elif isinstance(error, ValueError):
+                print(f"skipping non-sound file '{fp}'")
+            else:
+                raise error
+        if not len(tracks):
+            raise ValueError(f"directory should contain at least one sound file (directory='{dp}')")
+
+        return TrackList(tracks, policy, rng)
+
+
+class ChunkBank:
+
+    data: np.ndarray
+    offsets: np.ndarray
+    trackpaths: List[str]
+    rate: int
+    dtype: np.dtype
+    nchannels: int
+
+    samples_file = "samples.npy"
+    offsets_file = "offsets.npy"
+    meta_file = "chunkbank.json"
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        offsets: np.ndarray,
+        rate: int,
+        dtype: np.dtype|None = None,
+        trackpaths: List[str]|None = None,
+        policy: DtypePolicy = DEFAULT_POLICY,
+        rng: Seed = None
+    ):
+        """
+        packed corpus of chunks: all chunks are stored one after the other in a single contiguous array,
+        and chunk `i` is `data[offsets[i]:offsets[i+1]]`. all chunks have the same rate and number of channels.
+
+        a ChunkBank written to disk (see `ChunkBank.build`) is memory-mapped when it is read: processes that
+        read the same ChunkBank share its data through the OS page cache, instead of each holding a copy.
+        it can be used by `Splice` in place of a `TrackList`.
+
+        :param data: the chunks, concatenated along the first axis
+        :param offsets: the N+1 offsets of the N chunks in `data`
+        :param rate: the sampling rate of the chunks
+        :param dtype: the dtype of the source files of the chunks (defaults to `data.dtype`)
+        :param trackpaths: the paths to the source file of each chunk
+        :param policy: dtypes used to process the chunks (see `DtypePolicy`)
+        :param rng: random generator or seed used to pick chunks (see `make_rng`)
+        """
+        if offsets.ndim != 1 or offsets.shape[0] < 2:
+            raise ValueError(f"expected at least 2 offsets in a 1D array, got shape {offsets.shape}")
+        if offsets[-1] != data.shape[0]:
+            raise ValueError(f"the last offset ({offsets[-1]}) should be equal to the number of frames in 'data' ({data.shape[0]})")
+        self.data = data
+        self.offsets = offsets
+        self.rate = rate
+        self.dtype = data.dtype if dtype is None else np.dtype(dtype)
+        self.trackpaths = trackpaths if trackpaths is not None else [ "" for _ in range(len(offsets)-1) ]
+        self.nchannels = 1 if data.ndim == 1 else data.shape[1]
+        self.policy = policy
+        self.rng = make_rng(rng)
+        self.convert_to: int|None = None  # deferred channel conversion, applied to each chunk when it is read
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """number of frames of each chunk"""
+        return np.diff(self.offsets)
+
+    @classmethod
+    def is_bank(cls, dp: str|Path) -> bool:
+        """check if `dp` is a directory containing a ChunkBank"""
+        return fp_to_abs(dp).joinpath(cls.meta_file).exists()
+
+    @classmethod
+    def build(cls, tracklist: TrackList, dp: str|Path) -> "ChunkBank":
+        """
+        write the tracks of `tracklist` as a ChunkBank in directory `dp`, and return it.
+        all tracks must have the same rate and number of channels (see `TrackList.resample` and `TrackList.to_mono`).
+        the tracks are copied one by one into a memory-mapped file, so the whole ChunkBank is never held in RAM.
+
+        :param dp: path to an existing, empty directory
+        """
+        dp = fp_to_abs(dp)
+        tracks = tracklist.tracklist
+        if len(set(t.rate for t in tracks)) > 1:
+            raise ValueError("all tracks in a ChunkBank should have the same rate. use `TrackList.resample` first")
+        if len(set(t.nchannels for t in tracks)) > 1:
+            raise ValueError("all tracks in a ChunkBank should have the same number of channels. use `TrackList.to_mono` first")
+
+        offsets = lengths_to_offsets(np.array([ t.nframes for t in tracks ]))
+        first = tracks[0].get_data()
+        data = np.lib.format.open_memmap(
+            dp.joinpath(cls.samples_file),
+            mode="w+",
+            dtype=np.result_type(*[ t.data.dtype for t in tracks ]),
+            shape=(int(offsets[-1]), *first.shape[1:])
+        )
+        for i, t in enumerate(tracks):
+            data[offsets[i]:offsets[i+1]] = t.get_data()
+        data.flush()
+        del data
+        np.save(dp.joinpath(cls.offsets_file), offsets)
+        # the metadata file is written last: if it exists, the ChunkBank is complete
+        write_json(dp.joinpath(cls.meta_file), {
+            "rate": tracklist.rate,
+            "dtype": tracklist.dtype.str,
+            "trackpaths": [ str(t.trackpath) for t in tracks ]
+        })
+        return cls.read(dp)
+
+    @classmethod
+    def read(cls, dp: str|Path, policy: DtypePolicy = DEFAULT_POLICY, rng: Seed = None) -> "ChunkBank":
+        """read the ChunkBank in directory `dp`. its data is memory-mapped and read-only"""
+        dp = fp_to_abs(dp)
+        if not cls.is_bank(dp):
+            raise ValueError(f"'{dp}' is not a ChunkBank directory (missing '{cls.meta_file}')")
+        meta: Dict = read_json(dp.joinpath(cls.meta_file))  # pyright: ignore
+        return ChunkBank(
+            data=np.load(dp.joinpath(cls.samples_file), mmap_mode="r"),
+            offsets=np.load(dp.joinpath(cls.offsets_file)),
+            rate=meta["rate"],
+            dtype=np.dtype(meta["dtype"]),
+            trackpaths=meta["trackpaths"],
+            policy=policy,
+            rng=rng
+        )
+
+    def get(self, i: int) -> Track:
+        """return the chunk `i` as a Track. its data is a view on `self.data`: no data is copied"""
+        track = Track(self.rate, self.data[self.offsets[i]:self.offsets[i+1]], Path(self.trackpaths[i]), self.policy, self.dtype)
+        if self.convert_to is not None:
+            track.set_nchannels(self.convert_to, lazy=True)
+        return track
+
+    def get_one(self) -> Track:
+        return self.get(self.rng.integers(len(self)))
+
+    def resample(self, *args, **kwargs) -> "ChunkBank":
+        """all chunks of a ChunkBank have the same rate: no resampling is needed. defined for compatibility with `TrackList`"""
+        return self
+
+    def to_mono(self) -> "ChunkBank":
+        """convert the chunks to mono when they are read"""
+        self.convert_to = None if self.nchannels == 1 else 1
+        self.nchannels = 1
+        return self
+
+
+def tracks_to_bank(trackspath: str|Path, outpath: str|Path, nchannels: int, overwrite: bool) -> ChunkBank:
+    """
+    pack all sound files in `trackspath` into a ChunkBank written to `outpath`.
+    the tracks are resampled to the highest rate among them and converted to `nchannels` channels.
+    """
+    tracklist = TrackList.read_from_dir(trackspath)
+    for t in tracklist.tracklist:
+        t.set_nchannels(nchannels)
+    outpath = make_dir(outpath, overwrite)
+    return ChunkBank.build(tracklist, outpath)
@@ -1,36 +1,93 @@
-from typing import Tuple, List, Dict, Callable, Literal
+from typing import Tuple, List, Dict
 from pathlib import Path
-import random
 import json
 import re
 
 import numpy as np
 
-from src.utils.utils import get_random_item, array_plot
-from src.utils.validate import validate_comparison, validate_float_isinrange, validate_type
+from src.utils.utils import get_random_item, lengths_to_offsets, make_rng, Seed
+from src.utils.validate import validate_comparison, validate_float_isinrange, validate_type, should_validate
 from src.utils.io_op import fp_to_abs_validate, write_json, read_str, write_str, check_exists_file
+from src.utils.cache import ArrayLRUCache
+from src.utils.profile import stage, ENVELOPE
 from src.track import Track
 
-def to_linear_function(a: Tuple[int|float, int|float], b: Tuple[int|float, int|float]) -> Callable[[int], float|float]:
+def random_breakpoints(n: int, rng: np.random.Generator) -> np.ndarray:
     """
-    generate a linear function from 2 points a and b.
-    this function will be a multiplier that will be applied to a track.
-    adapted from: https://www.geogebra.org/m/mdxgkgtd
+    generate the breakpoint matrices of `n` random envelopes (see `Envelope`) at once, as an array of shape (n,2,5).
+    attack volume is 1, decay (and sustain) volume is in range 0.5..1, times are sorted random values in range 0..1.
     """
-    x_a, y_a = a
-    x_b, y_b = b
-    slope = (y_b-y_a) / (x_b-x_a)
-    intercept = y_a - slope * x_a  # y-offset when x=0. `slope * x_a` = the value of `y_a` if `intercept==0` => from there, we can calculate the intercept.
-    # print(f"x: x*{slope} + {intercept}")
-    return lambda x: x*slope + intercept
+    breakpoints = np.zeros((n, 2, 5), dtype=np.float64)
+    breakpoints[:, 0, 1:4] = np.sort(rng.random((n, 3)), axis=1)  # a_t, d_t, s_t
+    breakpoints[:, 0, 4] = 1
+    breakpoints[:, 1, 1] = 1  # a
+    breakpoints[:, 1, 2] = breakpoints[:, 1, 3] = rng.uniform(0.5, 1., n)  # d, s
+    return breakpoints
+
+def frame_positions(nframes: int, start: int = 0, end: int|None = None) -> np.ndarray:
+    """
+    position of frames `start` to `end` (exclusive) in a track of `nframes` frames (0=start, 1=end).
+    the positions are exactly `np.linspace(0, 1, nframes)[start:end]`, without computing the other frames:
+    the multiplier of a part of a track is the same as the same part of the multiplier of the whole track.
+    """
+    end = nframes if end is None else end
+    x = np.arange(start, end, dtype=np.float64)
+    if nframes > 1:
+        x *= 1. / (nframes - 1)
+        if end == nframes and end > start:
+            x[-1] = 1.  # like `np.linspace`, the last frame is exactly at the end
+    return x
+
+def interp_ragged(breakpoints: np.ndarray, lengths: np.ndarray, dtype: np.dtype|type = np.float64) -> np.ndarray:
+    """
+    generate the multipliers of N envelopes for N tracks of different lengths, in a single vectorized pass
+    (same output as `np.interp` over each track separately).
 
+    the frames of track `i` are at the positions `frame_positions(lengths[i])` (0=start, 1=end). for each envelope,
+    the number of frames before each breakpoint is computed exactly, which splits each track in 5 runs of frames:
+    one per segment of the envelope, and a last run past the last breakpoint. the slope and origin of each segment
+    are repeated over its run, so that no lookup is done per frame.
 
-class Envelope:
+    :param breakpoints: breakpoint matrices of the envelopes (see `Envelope`), of shape (N,2,5)
+    :param lengths: the number of frames in each track, of shape (N,)
+    :returns: a flat 1D ndarray of `sum(lengths)` frames: the multipliers of track `i` are at `multipliers[offsets[i]:offsets[i+1]]`
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    times, volumes = breakpoints[:, 0], breakpoints[:, 1]
+    nframes = lengths[:, np.newaxis]
+    step = 1. / np.maximum(nframes - 1, 1)  # distance between 2 frames (see `frame_positions`)
+
+    def position(k: np.ndarray) -> np.ndarray:
+        """position of frame `k` of each track, as in `frame_positions`"""
+        return np.where((k == nframes - 1) & (nframes > 1), 1., k * step)
+
+    # number of frames strictly before each breakpoint: the first frame `k` with `position(k) >= times`.
+    # the estimate from `times / step` is off by at most one frame, because of rounding: it is corrected on both sides
+    before = np.clip(np.ceil(times / step), 0, nframes).astype(np.int64)
+    before -= (before > 0) & (position(before - 1) >= times)
+    before += (before < nframes) & (position(before) < times)
+    runs = np.diff(before[:, 1:], prepend=0, append=nframes, axis=1)  # (N,5) frames per segment
+
+    # segment `j` goes from breakpoint `j` to `j+1`. past the last breakpoint, the volume is constant
+    width = np.diff(times, axis=1)
+    slope = np.zeros(times.shape)
+    with np.errstate(over="ignore"):
+        np.divide(np.diff(volumes, axis=1), width, out=slope[:, :-1], where=width > 0)
+    # a segment too narrow for its slope to be finite only contains frames at its origin: their volume is the volume at the origin
+    slope[~np.isfinite(slope)] = 0.
+    origin = times.copy()
+    origin[:, -1] = 0.
+
+    x = np.arange(lengths.sum(), dtype=np.float64)
+    x -= np.repeat(lengths_to_offsets(lengths)[:-1], lengths)  # index of each frame in its track
+    x *= np.repeat(step[:, 0], lengths)  # the last frame of a track is past the last breakpoint (1): its position is not used
+    x -= np.repeat(origin.ravel(), runs.ravel())
+    x *= np.repeat(slope.ravel(), runs.ravel())
+    x += np.repeat(volumes.ravel(), runs.ravel())
+    return x.astype(dtype, copy=False)
 
-    #NOTE a possible optimisation would be to internally represent the envelope as a 2D matrix of shape:
-    # >>> [ [0, a_t, d_t,   1],    # start-attack-decay-sustain-end time, 0..1
-    # ...   [0,   a,   d,   0] ]   # start-attack-decay-sustain-end volumes, 0..1
-    # and then do numpy operations.
+
+class Envelope:
 
     curves_allowed = ["linear"]
     curve_default = "linear"
@@ -42,7 +99,8 @@ class Envelope:
         d:float,
         d_t:float,
         s_t: float,
-        curve: str|None = None
+        curve: str|None = None,
+        validate_off: bool = False
     ):
         """
         ADSR envelope to apply to a prerecorded Track.
@@ -69,19 +127,21 @@ class Envelope:
         :param d_t: decay time
         :param s_t: sustain time. sustain volume is implicitly defined as equal to `d`
         :param curve: interpolation curve
+        :param validate_off: disable validation (see `should_validate`). for internal callers whose values are valid by construction
         """
-        try:
-            # assert that all values are in 0..1 range
-            for v in [ a, d, a_t, d_t, s_t ]:
-                validate_float_isinrange(v, 0, 1, inclusive=True)
-            # assert that times are correctly ordered
-            for x1, x2 in ((0,a_t), (a_t,d_t), (d_t,s_t), (s_t,1)):
-                assert x1<=x2
-        except (AssertionError, ValueError):
-            print(
-                "invalid envelope: expected 0 <= a_t <= d_t and a <= 1 and d <= 1, got: {}"
-                .format(json.dumps({ "a":a, "a_t":a_t, "d":d, "d_t":d_t, "s_t":s_t }))
-            )
+        if should_validate(validate_off):
+            try:
+                # assert that all values are in 0..1 range
+                for v in [ a, d, a_t, d_t, s_t ]:
+                    validate_float_isinrange(v, 0, 1, inclusive=True)
+                # assert that times are correctly ordered
+                for x1, x2 in ((0,a_t), (a_t,d_t), (d_t,s_t), (s_t,1)):
+                    assert x1<=x2
+            except (AssertionError, ValueError, TypeError):
+                raise ValueError(
+                    "invalid envelope: expected 0 <= a_t <= d_t <= s_t <= 1 and 0 <= a, d <= 1, got: {}"
+                    .format(json.dumps({ "a":a, "a_t":a_t, "d":d, "d_t":d_t, "s_t":s_t }))
+                ) from None
 
         # NOTE: other interpolation options: https://www.w3resource.com/numpy/snippet/numpy-interpolation-guide.php
         curve = self.curve_default if curve == None else curve
@@ -99,27 +159,33 @@ class Envelope:
         self.s_t = s_t
         self.curve = curve
 
-        if self.curve == "linear":
-            self.attack_mul = to_linear_function((0,0), (a_t,a))
-            self.decay_mul = to_linear_function((a_t,a), (d_t,d))
-            self.sustain_mul = to_linear_function((d_t,d), (s_t,s))
-            self.release_mul = to_linear_function((s_t,s), (1,0))
+        # the envelope is internally represented as a 2D breakpoint matrix of shape (2,5):
+        # >>> [ [0, a_t, d_t, s_t, 1],    # start-attack-decay-sustain-end time, 0..1
+        # ...   [0,   a,   d,   s, 0] ]   # start-attack-decay-sustain-end volumes, 0..1
+        # the multiplier for a whole track is then computed by a single interpolation over this matrix.
+        self.breakpoints = np.array([
+            [0, a_t, d_t, s_t, 1],
+            [0,   a,   d,   s, 0]
+        ], dtype=np.float64)
         return
 
     @classmethod
-    def random(cls) -> 'Envelope':
+    def random(cls, rng: Seed = None) -> 'Envelope':
         """
         generate an envelope with random values
+
+        :param rng: random generator or seed (see `make_rng`)
         """
-        a_t, d_t, s_t = sorted([ random.random() for _ in range(0,3) ])
-        return Envelope(
-            a=1,
-            d=random.uniform(0.5, 1.),
-            a_t=a_t,
-            d_t=d_t,
-            s_t=s_t,
-            curve=random.choice(cls.curves_allowed)
-        )
+        rng = make_rng(rng)
+        return cls.from_breakpoints(random_breakpoints(1, rng)[0], get_random_item(cls.curves_allowed, rng))
+
+    @classmethod
+    def from_breakpoints(cls, breakpoints: np.ndarray, curve: str|None = None) -> "Envelope":
+        """
+        create an envelope from a breakpoint matrix of shape (2,5) (see `Envelope.__init__`), without validation
+        """
+        (_, a_t, d_t, s_t, _), (_, a, d, _, _) = breakpoints.tolist()
+        return Envelope(a=a, a_t=a_t, d=d, d_t=d_t, s_t=s_t, curve=curve, validate_off=True)
 
     @classmethod
     def from_dict(cls, env:Dict) -> "Envelope":
@@ -154,108 +220,145 @@ class Envelope:
     def write(self, path:str|Path):
         write_json(path, self.to_dict())
 
-    def get_mul_func(self, step_name: Literal["a","d","s","r"]) -> Callable:
-        if step_name == "a":
-            return self.attack_mul
-        elif step_name == "d":
-            return self.decay_mul
-        elif step_name == "s":
-            return self.sustain_mul
-        elif step_name == "r":
-            return self.release_mul
-        return
+    @property
+    def key(self) -> Tuple:
+        """hashable identifier of the envelope: 2 envelopes with the same key produce the same multipliers"""
+        return (self.a, self.d, self.a_t, self.d_t, self.s_t, self.curve)
 
     def make_multiplier(
         self,
-        lin_func: Callable,
-        track_step: np.ndarray,
-        pct_start: float,
-        pct_end: float,
+        nframes: int,
+        dtype: np.dtype|type = np.float64,
+        start: int = 0,
+        end: int|None = None
     ) -> np.ndarray:
         """
-        generate a multiplier for single envelope step (attack/decay/sustain/release) for the relevant part of a track.
+        generate the multiplier for a track of `nframes` frames.
 
-        basically a multiplier is an ndarray of values in range 0..1 used to apply
-        `self.(attack|decay|sustain|release)_mul`.
-        the multiplier expands the *_mul functions (defined with 0 being the start of
-        the track, 1 being the end) to have as many values as the track has frames.
-        it will be used to multiply each value in `track_step.data`, thus applying the envelope.
+        a multiplier is a 1D ndarray of values in range 0..1 with one value per frame.
+        it is computed in a single pass by interpolating every frame's position in the
+        track (0=start, 1=end) over `self.breakpoints`.
 
-        :param lin_func: a function generated from plotting a line between 2 points
-        :param track_step: a slice of a numpy array
-        :param pct_start: the start of track_step within the entire track in range 0..1
-        :param pct_end: the end track_step within the entire track in range 0..1
+        :param nframes: number of frames in the track
+        :param dtype: dtype of the multiplier. should match the dtype of the track the envelope will be applied to.
+        :param start: only generate the multiplier from frame `start` (inclusive)...
+        :param end: ...to frame `end` (exclusive). if None, `end=nframes`
         """
-        indices = np.linspace(pct_start, pct_end, track_step.shape[0])
-        multipliers = lin_func(indices)
-        return multipliers
+        times, volumes = self.breakpoints
+        multiplier = np.interp(frame_positions(nframes, start, end), times, volumes)
+        return multiplier.astype(dtype, copy=False)
 
-    def apply_step(
-        self,
-        lin_func: Callable,
-        track_step: np.ndarray,
-        pct_start: float,
-        pct_end: float,
-    ) -> np.ndarray:
+    def get_multiplier(self, nframes: int, dtype: np.dtype|type = np.float64, cache: ArrayLRUCache|None = None) -> np.ndarray:
         """
-        generate and apply an envelope multiplier to the relevant slice of a track.
+        return the multiplier for a track of `nframes` frames, using `cache` if provided.
+        multipliers are cached by envelope, number of frames and dtype.
         """
-        return track_step * self.make_multiplier(lin_func, track_step, pct_start, pct_end)
+        if cache is None:
+            return self.make_multiplier(nframes, dtype)
+        return cache.get_or_make(
+            (self.key, nframes, np.dtype(dtype).str),
+            lambda: self.make_multiplier(nframes, dtype)
+        )
 
-    def apply(self, track: Track) -> Track:
+    def apply(self, track: Track, cache: ArrayLRUCache|None = None) -> Track:
         """
-        apply an envelope to a Track
+        apply an envelope to a Track. `track.data` is modified in place.
+        data is converted to the processing dtype of the track (see `DtypePolicy`) before applying the envelope.
+
+        NOTE: if `track.data` is already a writeable array of the processing dtype, that array is modified:
+        a track whose data is shared with a corpus (a TrackList) changes the corpus. use `Track.copy` first to keep it.
+        read-only data (memory-mapped cache entries or ChunkBank chunks) is copied and never modified.
+
+        :param track: the track to apply the envelope to
+        :param cache: cache of multipliers (optional). useful when the same envelopes are applied repeatedly to the same tracks
         """
-        envelope_data = [
-            (self.attack_mul, 0, self.a_t),
-            (self.decay_mul, self.a_t, self.d_t),
-            (self.sustain_mul, self.d_t, self.s_t),
-            (self.release_mul, self.s_t, 1)
-        ]
-        track_enveloped = np.concat(
-            [
-                self.apply_step(
-                    lin_func,
-                    track.get_range(pct_start, pct_end),
-                    pct_start,
-                    pct_end
-                ) for lin_func, pct_start, pct_end in envelope_data
-            ],
-            axis=0
-        )
-        track.data = track_enveloped
+        with stage(ENVELOPE):
+            data = track.policy.to_float(track.get_data())
+            if not data.flags.writeable:
+                data = data.copy()
+            multiplier = self.get_multiplier(data.shape[0], data.dtype, cache)
+            if data.ndim > 1:
+                multiplier = multiplier[:, np.newaxis]  # broadcast the multiplier over all channels
+            np.multiply(data, multiplier, out=data)
+        track.data = data
+        track.convert_to = None
         return track
 
 
 class EnvelopeList:
 
     envlist: List[Envelope]
+    cache: ArrayLRUCache
+    rng: np.random.Generator
 
-    def __init__(self, envlist:List[Envelope], overwrite: bool = False):
-        for env in envlist:
-            validate_type(env, Envelope)
+    def __init__(
+        self,
+        envlist:List[Envelope],
+        overwrite: bool = False,
+        cache_entries: int|None = 128,
+        cache_bytes: int|None = None,
+        validate_off: bool = False,
+        rng: Seed = None
+    ):
+        """
+        :param envlist: the envelopes
+        :param overwrite: overwrite the output file when writing the EnvelopeList
+        :param cache_entries: maximum number of multipliers to cache (if None, no limit)
+        :param cache_bytes: maximum size of the multiplier cache in bytes (if None, no limit)
+        :param validate_off: disable validation (see `should_validate`)
+        :param rng: random generator or seed used to pick envelopes (see `make_rng`)
+        """
+        if should_validate(validate_off):
+            for env in envlist:
+                validate_type(env, Envelope)
         self.envlist = envlist
         self.overwrite = overwrite
+        self.cache = ArrayLRUCache(cache_entries, cache_bytes)
+        self.rng = make_rng(rng)
+        self._breakpoints: np.ndarray|None = None
+        self._curves: np.ndarray|None = None
+
+    def __len__(self) -> int:
+        return len(self.envlist)
+
+    @property
+    def breakpoints(self) -> np.ndarray:
+        """the breakpoint matrices of all envelopes, of shape (N,2,5). computed once, when first used"""
+        if self._breakpoints is None:
+            self._breakpoints = np.stack([ env.breakpoints for env in self.envlist ])
+        return self._breakpoints
+
+    @property
+    def curves(self) -> np.ndarray:
+        """the curve of all envelopes, as indices in `Envelope.curves_allowed`, of shape (N,). computed once, when first used"""
+        if self._curves is None:
+            self._curves = np.array([ Envelope.curves_allowed.index(env.curve) for env in self.envlist ], dtype=np.int64)
+        return self._curves
 
     @classmethod
-    def random(cls, n:int = 10) -> "EnvelopeList":
+    def random(cls, n:int = 10, rng: Seed = None) -> "EnvelopeList":
         """
-        generate an EnvelopeList containing `n` random Envelopes
+        generate an EnvelopeList containing `n` random Envelopes.
+        the random values of all envelopes are generated at once (see `random_breakpoints`)
+
+        :param rng: random generator or seed (see `make_rng`)
         """
         n = validate_type(n, int)
         validate_comparison("lt", 0, n)
+        rng = make_rng(rng)
+        curves = rng.integers(len(Envelope.curves_allowed), size=n)
         return EnvelopeList([
-            Envelope.random()
-            for _ in range(1, n+1)
-        ])
+            Envelope.from_breakpoints(bp, Envelope.curves_allowed[c])
+            for bp, c in zip(random_breakpoints(n, rng), curves)
+        ], validate_off=True, rng=rng)
 
     @classmethod
-    def from_list(cls, envlist:List[Dict]) -> "EnvelopeList":
+    def from_list(cls, envlist:List[Dict], rng: Seed = None) -> "EnvelopeList":
         envlist = validate_type(envlist, list)
         return EnvelopeList([
             Envelope.from_dict(env)
             for env in envlist
-        ])
+        ], validate_off=True, rng=rng)
 
     def to_list(self) -> List[Dict]:
         """
@@ -266,7 +369,7 @@ class EnvelopeList:
         ]
 
     @classmethod
-    def read(cls, fp: str|Path) -> 'EnvelopeList':
+    def read(cls, fp: str|Path, rng: Seed = None) -> 'EnvelopeList':
         """
         read and parse the env list an d return is as an EnvelopeList.
         we expect "\n"-separated envelopes representing dicts
@@ -281,7 +384,7 @@ class EnvelopeList:
             if not empty_line.search(l)
         ]
 
-        return EnvelopeList.from_list(envlist_list)
+        return EnvelopeList.from_list(envlist_list, rng)
 
     def write(self, fp:Path|str) -> 'EnvelopeList':
         check_exists_file(fp, self.overwrite)
@@ -289,10 +392,192 @@ class EnvelopeList:
         return self
 
     def get_one(self) -> Envelope:
-        return get_random_item(self.envlist)
+        return get_random_item(self.envlist, self.rng)
+
+
+class EnvelopeBank:
+
+    breakpoints: np.ndarray
+    curves: np.ndarray
+    cache: ArrayLRUCache|None
+
+    def __init__(self, envlist: List[Envelope], validate_off: bool = False, cache: ArrayLRUCache|None = None):
+        """
+        a batch of N envelopes to apply to N tracks in a single vectorized operation.
+        the envelope at position `i` in `envlist` is applied to the track at position `i`.
+
+        :param envlist: the envelopes
+        :param validate_off: disable validation (see `should_validate`)
+        :param cache: cache of multipliers (optional), keyed by breakpoints, number of frames and dtype.
+            useful when the envelopes are picked from a fixed set (see `EnvelopeList.cache`)
+        """
+        if should_validate(validate_off):
+            for env in envlist:
+                validate_type(env, Envelope)
+        if not len(envlist):
+            raise ValueError("EnvelopeBank.envlist is empty")
+        self.breakpoints = np.stack([ env.breakpoints for env in envlist ])  # shape (N,2,5)
+        self.curves = np.array([ Envelope.curves_allowed.index(env.curve) for env in envlist ], dtype=np.int64)  # shape (N,)
+        self.cache = cache
+
+    def __len__(self) -> int:
+        return self.breakpoints.shape[0]
+
+    @property
+    def envlist(self) -> List[Envelope]:
+        """the envelopes, as a list of Envelope"""
+        return [ Envelope.from_breakpoints(bp, Envelope.curves_allowed[c]) for bp, c in zip(self.breakpoints, self.curves) ]
+
+    @classmethod
+    def from_breakpoints(cls, breakpoints: np.ndarray, cache: ArrayLRUCache|None = None, curves: np.ndarray|None = None) -> "EnvelopeBank":
+        """
+        create an EnvelopeBank from the breakpoint matrices of N envelopes, of shape (N,2,5), without validation
+
+        :param curves: the curve of each envelope, as indices in `Envelope.curves_allowed`, of shape (N,). if None, `Envelope.curve_default`
+        """
+        if breakpoints.ndim != 3 or breakpoints.shape[1:] != (2, 5) or not breakpoints.shape[0]:
+            raise ValueError(f"expected breakpoints of shape (N,2,5) with N > 0, got {breakpoints.shape}")
+        if curves is None:
+            curves = np.full(breakpoints.shape[0], Envelope.curves_allowed.index(Envelope.curve_default), dtype=np.int64)
+        elif curves.shape != breakpoints.shape[:1]:
+            raise ValueError(f"expected {breakpoints.shape[0]} curves, got shape {curves.shape}")
+        bank = cls.__new__(cls)
+        bank.breakpoints = breakpoints
+        bank.curves = curves
+        bank.cache = cache
+        return bank
+
+    @classmethod
+    def random(cls, n: int, rng: Seed = None) -> "EnvelopeBank":
+        """
+        generate an EnvelopeBank containing `n` random Envelopes, without creating `Envelope` objects
 
+        :param rng: random generator or seed (see `make_rng`)
+        """
+        return cls.from_breakpoints(random_breakpoints(n, make_rng(rng)))
 
-def random_envs_to_file(n:int, fp: str|Path, overwrite: bool) -> None:
-    envlist = EnvelopeList.random(n)
-    envlist.overwrite = overwrite
-    envlist.write(fp)
+    @classmethod
+    def from_envelopelist(cls, envlist: EnvelopeList, n: int) -> "EnvelopeBank":
+        """
+        generate an EnvelopeBank of `n` Envelopes picked at random from `envlist`, using `envlist.rng`.
+        the bank shares the multiplier cache of `envlist`
+        """
+        picked = envlist.rng.integers(len(envlist), size=n)
+        return cls.from_breakpoints(envlist.breakpoints[picked], envlist.cache, envlist.curves[picked])
+
+    def write(self, fp: Path|str, overwrite: bool = False) -> "EnvelopeBank":
+        """
+        write the envelopes to `fp`, in the same format as `EnvelopeList.write` (see `Envelope.to_dict`).
+        the dicts are built directly from `self.breakpoints` and `self.curves`, without creating `Envelope` objects.
+        """
+        check_exists_file(fp, overwrite)
+        times, volumes = self.breakpoints[:, 0], self.breakpoints[:, 1]
+        envlist = [
+            { "a": a, "d": d, "a_t": a_t, "d_t": d_t, "s_t": s_t, "curve": Envelope.curves_allowed[c] }
+            for a, d, a_t, d_t, s_t, c in zip(
+                volumes[:, 1].tolist(), volumes[:, 2].tolist(), times[:, 1].tolist(), times[:, 2].tolist(), times[:, 3].tolist(), self.curves.tolist()
+            )
+        ]
+        write_str(fp, "\n".join(json.dumps(d) for d in envlist))
+        return self
+
+    def make_multipliers(self, nframes: int, dtype: np.dtype|type = np.float64) -> np.ndarray:
+        """
+        generate the multipliers for N tracks of `nframes` frames each,
+        as a 2D ndarray of shape (N, nframes) (see `EnvelopeBank.make_multipliers_ragged`).
+        """
+        return self.make_multipliers_ragged(np.full(len(self), nframes), dtype).reshape(len(self), nframes)
+
+    def make_multipliers_ragged(self, lengths: np.ndarray, dtype: np.dtype|type = np.float64) -> np.ndarray:
+        """
+        generate the multipliers for N tracks of different lengths,
+        as a flat 1D ndarray of `sum(lengths)` frames: the multipliers
+        of the track `i` are at `multipliers[offsets[i]:offsets[i+1]]`.
+        if the bank has a cache, cached multipliers are reused and the new ones are cached.
+
+        :param lengths: the number of frames in each track, of shape (N,)
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if lengths.shape != (len(self),):
+            raise ValueError(f"expected {len(self)} lengths, got shape {lengths.shape}")
+        dtype = np.dtype(dtype)
+        if self.cache is None:
+            return interp_ragged(self.breakpoints, lengths, dtype)
+        offsets = lengths_to_offsets(lengths)
+        multipliers = np.empty(offsets[-1], dtype=dtype)
+
+        # each distinct multiplier is generated once: it is copied from the cache or from its first occurrence in the bank.
+        # the multipliers missing from the cache are generated in a single batch
+        keys = [ (bp.tobytes(), n, dtype.str) for bp, n in zip(self.breakpoints, lengths.tolist()) ]
+        made: Dict[Tuple, np.ndarray|None] = {}
+        todo: List[int] = []  # first occurrence of each multiplier that is not cached
+        for i, key in enumerate(keys):
+            if key not in made:
+                made[key] = self.cache.get(key)
+                if made[key] is None:
+                    todo.append(i)
+        if len(todo):
+            new = interp_ragged(self.breakpoints[todo], lengths[todo], dtype)
+            for i, multiplier in zip(todo, np.split(new, lengths_to_offsets(lengths[todo])[1:-1])):
+                made[keys[i]] = self.cache.put(keys[i], multiplier.copy())
+        for i, key in enumerate(keys):
+            multipliers[offsets[i]:offsets[i+1]] = made[key]
+        return multipliers
+
+    def apply_matrix(self, data: np.ndarray) -> np.ndarray:
+        """
+        apply the envelopes to N tracks of the same length, in place.
+
+        :param data: float ndarray of shape (N, nframes) (mono) or (N, nframes, nchannels)
+        """
+        multipliers = self.make_multipliers(data.shape[1], data.dtype)
+        if data.ndim > 2:
+            multipliers = multipliers[:, :, np.newaxis]
+        np.multiply(data, multipliers, out=data)
+        return data
+
+    def apply_ragged(self, data: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """
+        apply the envelopes to N tracks of different lengths, in place.
+
+        :param data: float ndarray containing the N tracks concatenated along the first axis,
+            of shape (sum(lengths),) (mono) or (sum(lengths), nchannels)
+        :param lengths: the number of frames in each track, of shape (N,)
+        """
+        multipliers = self.make_multipliers_ragged(lengths, data.dtype)
+        if data.ndim > 1:
+            multipliers = multipliers[:, np.newaxis]
+        np.multiply(data, multipliers, out=data)
+        return data
+
+    def apply(self, tracks: List[Track]) -> List[Track]:
+        """
+        apply the envelope at position `i` to the track at position `i`.
+        all tracks must have the same number of channels.
+
+        tracks are copied into a single buffer (a 2D matrix if all tracks have the same length,
+        an offset-indexed batch otherwise) and the envelopes are applied to it in a single operation.
+        `tracks` are not modified: new Tracks are returned, whose data are views on that buffer.
+        data is converted to the processing dtype of the first track (see `DtypePolicy`).
+        """
+        with stage(ENVELOPE):
+            if len(tracks) != len(self):
+                raise ValueError(f"expected {len(self)} tracks, got {len(tracks)}")
+            dtype = tracks[0].policy.precision
+            lengths = np.array([ t.nframes for t in tracks ], dtype=np.int64)
+
+            if np.all(lengths == lengths[0]):
+                batch = np.stack([ t.get_data() for t in tracks ]).astype(dtype, copy=False)
+                self.apply_matrix(batch)
+                views = list(batch)
+            else:
+                batch = np.concatenate([ t.get_data() for t in tracks ], axis=0).astype(dtype, copy=False)
+                self.apply_ragged(batch, lengths)
+                views = np.split(batch, lengths_to_offsets(lengths)[1:-1])
+        return [ Track(t.rate, v, t.trackpath, t.policy, t.native_dtype) for t, v in zip(tracks, views) ]
+
+
+def random_envs_to_file(n:int, fp: str|Path, overwrite: bool, seed: Seed = None) -> None:
+    n = validate_type(n, int)
+    validate_comparison("lt", 0, n)
+    EnvelopeBank.random(n, seed).write(fp, overwrite)
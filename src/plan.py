@@ -0,0 +1,154 @@
+from pathlib import Path
+from typing import List, Dict, Any
+
+import numpy as np
+
+from src.utils.io_op import check_exists_file, fp_to_abs_validate
+from src.utils.parallel import thread_map_bounded
+from src.utils.utils import Seed
+from src.track import Track, TrackList, DtypePolicy, DEFAULT_POLICY
+
+PLAN_VERSION = 1
+
+# one row per impulse of the output track
+PLAN_DTYPE = np.dtype([
+    ("start", np.int64),                  # start frame of the impulse in the output track
+    ("chunk", np.int64),                  # index of the chunk played by the impulse in the corpus (see `SplicePlan.trackpaths`)
+    ("envelope", np.int64),               # index of the envelope in the EnvelopeList, or -1 if the envelope is random or there is no envelope
+    ("breakpoints", np.float64, (2, 5)),  # breakpoint matrix of the envelope (see `Envelope`). NaN if there is no envelope
+    ("gains", np.float64, (2,)),          # left/right gains of the impulse (see `pan_gains`). (1, 1) if the output track is mono
+])
+
+
+class SplicePlan:
+
+    timeline: np.ndarray
+    rate: int
+    length: int
+    nchannels: int
+    dtype: np.dtype
+    trackpaths: List[str]
+
+    def __init__(
+        self,
+        timeline: np.ndarray,
+        rate: int,
+        length: int,
+        nchannels: int,
+        dtype: np.dtype|str,
+        trackpaths: List[str]
+    ):
+        """
+        all the random decisions of a `Splice`, as a timeline of impulses: a structured array with
+        one row per impulse (see `PLAN_DTYPE`). a plan is made by `Splice.make_plan` and rendered by `Splice.render`:
+        rendering a plan again gives the same output track, without redrawing random decisions.
+
+        :param timeline: structured array of dtype `PLAN_DTYPE`, of shape (nimpulses,)
+        :param rate: sampling rate of the output track
+        :param length: length of the output track, in frames
+        :param nchannels: number of channels of the output track
+        :param dtype: native dtype of the corpus, which defines the scale of the output track (see `DtypePolicy`)
+        :param trackpaths: path to the source file of each chunk of the corpus. the `chunk` of an impulse is an index in `trackpaths`
+        """
+        if timeline.dtype != PLAN_DTYPE or timeline.ndim != 1:
+            raise ValueError(f"expected a timeline of shape (nimpulses,) and dtype {PLAN_DTYPE}, got shape {timeline.shape} and dtype {timeline.dtype}")
+        if len(timeline) and (timeline["chunk"].min() < 0 or timeline["chunk"].max() >= len(trackpaths)):
+            raise ValueError(f"chunk indices of the timeline should be in range [0, {len(trackpaths)})")
+        self.timeline = timeline
+        self.rate = int(rate)
+        self.length = int(length)
+        self.nchannels = int(nchannels)
+        self.dtype = np.dtype(dtype)
+        self.trackpaths = [ str(fp) for fp in trackpaths ]
+
+    def __len__(self) -> int:
+        return self.timeline.shape[0]
+
+    @classmethod
+    def empty(cls, nimpulses: int) -> np.ndarray:
+        """allocate a timeline of `nimpulses` impulses, without envelopes and with unit gains"""
+        timeline = np.zeros(nimpulses, dtype=PLAN_DTYPE)
+        timeline["envelope"] = -1
+        timeline["breakpoints"] = np.nan
+        timeline["gains"] = 1.
+        return timeline
+
+    def save(self, fp: str|Path, overwrite: bool = False) -> "SplicePlan":
+        """
+        write the plan to `fp` as an uncompressed npz archive.
+        NOTE: the plan is written to `fp` as is: unlike `np.savez`, no `.npz` extension is appended
+        """
+        fp, _ = check_exists_file(fp, overwrite)
+        with open(fp, mode="wb") as fh:
+            np.savez(
+                fh,
+                version=PLAN_VERSION,
+                timeline=self.timeline,
+                rate=self.rate,
+                length=self.length,
+                nchannels=self.nchannels,
+                dtype=self.dtype.str,
+                trackpaths=np.array(self.trackpaths, dtype=str)
+            )
+        return self
+
+    @classmethod
+    def load(cls, fp: str|Path) -> "SplicePlan":
+        """read a plan written by `SplicePlan.save`"""
+        fp = fp_to_abs_validate(fp)
+        with np.load(fp, allow_pickle=False) as archive:
+            data: Dict[str, Any] = { k: archive[k] for k in archive.files }
+        if int(data["version"]) != PLAN_VERSION:
+            raise ValueError(f"unsupported plan version: expected {PLAN_VERSION}, got {int(data['version'])} (plan='{fp}')")
+        return SplicePlan(
+            timeline=data["timeline"],
+            rate=int(data["rate"]),
+            length=int(data["length"]),
+            nchannels=int(data["nchannels"]),
+            dtype=str(data["dtype"]),
+            trackpaths=data["trackpaths"].tolist()
+        )
+
+    def compact(self) -> "SplicePlan":
+        """
+        return a plan that only references the chunks played by its impulses: unused chunks are removed
+        from `trackpaths`, and the impulses are renumbered accordingly. the output track is the same.
+        """
+        used, chunk = np.unique(self.timeline["chunk"], return_inverse=True)
+        timeline = self.timeline.copy()
+        timeline["chunk"] = chunk.reshape(-1)
+        return SplicePlan(timeline, self.rate, self.length, self.nchannels, self.dtype, [ self.trackpaths[i] for i in used ])
+
+    def check_chunks(self, chunks: TrackList|Any) -> "SplicePlan":
+        """
+        check that the plan can be rendered with the corpus `chunks` (a TrackList or a ChunkBank):
+        the rates must be the same, and the chunks played by the impulses must come from the same source files.
+        """
+        if chunks.rate != self.rate:
+            raise ValueError(f"the plan was made for a rate of {self.rate}Hz, but the chunks have a rate of {chunks.rate}Hz")
+        if len(chunks) != len(self.trackpaths):
+            raise ValueError(f"the plan was made for a corpus of {len(self.trackpaths)} chunks, but got {len(chunks)} chunks")
+        used = np.unique(self.timeline["chunk"])
+        corpus_paths = chunks.trackpaths
+        mismatch = [ i for i in used.tolist() if corpus_paths[i] != self.trackpaths[i] ]
+        if len(mismatch):
+            i = mismatch[0]
+            raise ValueError(f"{len(mismatch)} chunks of the plan do not match the corpus (chunk {i}: expected '{self.trackpaths[i]}', got '{corpus_paths[i]}')")
+        return self
+
+    def read_chunks(self, policy: DtypePolicy = DEFAULT_POLICY, rng: Seed = None, nworkers: int = 4) -> TrackList:
+        """
+        read the chunks of the plan from their source files, resampled to `self.rate` and converted to mono.
+        only the files in `self.trackpaths` are read: use `SplicePlan.compact` first to skip the chunks that are not played.
+        the chunks are rescaled to `self.dtype`, the native dtype of the whole corpus, even if the files read have other dtypes.
+
+        :param nworkers: number of threads used to decode the files
+        """
+        def read(fp: str) -> Track:
+            return Track.read(fp, policy=policy).resample(self.rate, validate_off=True).to_mono()
+        tracks = []
+        for fp, track, error in thread_map_bounded(read, self.trackpaths, nworkers):
+            if error is not None:
+                raise error
+            tracks.append(track)
+        return TrackList(tracks, policy, rng, self.dtype)
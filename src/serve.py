@@ -0,0 +1,419 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict
+from typing import Dict, Any, Tuple, List, Callable
+from pathlib import Path
+import socketserver
+import threading
+import inspect
+import hmac
+import json
+import time
+import os
+
+from src.utils.io_op import fp_to_abs
+from src.track import TrackList, DtypePolicy
+from src.envelope import EnvelopeList
+from src.corpus import CorpusCache, ChunkBank
+from src.split import Split
+from src.splice import Splice
+from src.constants import SERVE_HOST, SERVE_PORT, SERVE_QUEUE, SERVE_MAX_CORPORA, FORMAT_NATIVE, ENV_RANDOM, ENV_NONE
+
+JOB_SPLIT = "split"
+JOB_SPLICE = "splice"
+JOB_TYPES = [JOB_SPLIT, JOB_SPLICE]
+
+# parameters of a job, by job type. `format` is accepted as an alias of `format_`.
+# `overwrite` is not accepted: a job can't replace existing files
+JOB_PARAMS = {
+    JOB_SPLIT: [ p for p in inspect.signature(Split.__init__).parameters if p not in ("self", "make_outpath", "overwrite") ],
+    JOB_SPLICE: [ p for p in inspect.signature(Splice.__init__).parameters if p not in ("self", "chunks", "overwrite") ],
+}
+
+
+class JobError(Exception):
+    """invalid job request"""
+
+
+class QueueFullError(Exception):
+    """all workers are busy and the queue is full"""
+
+
+def corpus_signature(dp: Path) -> Tuple:
+    """
+    cheap signature of the contents of directory `dp`, computed without reading any file: if it
+    changes, the resident corpus for `dp` is stale and is loaded again.
+    """
+    if ChunkBank.is_bank(dp):
+        st = dp.joinpath(ChunkBank.meta_file).stat()
+        return (st.st_mtime_ns, st.st_size)
+    return tuple(sorted(
+        (e.name, e.stat().st_size, e.stat().st_mtime_ns)
+        for e in os.scandir(dp)
+        if e.is_file()
+    ))
+
+
+class WarmStore:
+
+    def __init__(self, max_corpora: int = SERVE_MAX_CORPORA):
+        """
+        keep the corpora (TrackLists and ChunkBanks) and EnvelopeLists used by jobs resident in memory,
+        so that each file is decoded, resampled and converted to mono once, and not once per job.
+
+        corpora are keyed by (absolute directory path, precision), envelope lists by absolute file path.
+        the output format is not part of the key: it only applies when the output track is written (see `Splice`).
+        a resident object is loaded again if its files changed on disk (see `corpus_signature`).
+        resident objects are shared by all jobs and never modified: each job uses a shallow copy with its own
+        random generator (see `Splice`).
+
+        at most `max_corpora` corpora are resident: when another corpus is loaded, the least recently used one
+        is evicted. jobs that are using an evicted corpus keep it until they end.
+
+        concurrent jobs that need the same object that is not resident yet wait for a single load.
+
+        :param max_corpora: maximum number of resident corpora
+        """
+        if max_corpora < 1:
+            raise ValueError(f"invalid value for 'max_corpora': expected an int >= 1, got '{max_corpora}'")
+        self.max_corpora = max_corpora
+        self.corpora: OrderedDict[Tuple, Tuple[Tuple, TrackList|ChunkBank]] = OrderedDict()  # least recently used first
+        self.envelopes: Dict[str, Tuple[Tuple, EnvelopeList]] = {}
+        self.lock = threading.Lock()
+        self.key_locks: Dict[Tuple, threading.Lock] = {}
+
+    def key_lock(self, key: Tuple) -> threading.Lock:
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def get_corpus(
+        self,
+        trackspath: str|Path,
+        precision: str = "float32",
+        cache_dir: str|Path|None = None
+    ) -> Tuple[TrackList|ChunkBank, bool]:
+        """
+        :returns: the resident corpus in `trackspath`, resampled and converted to mono, and whether it was already resident
+        """
+        dp = fp_to_abs(trackspath).resolve()
+        if not dp.is_dir():
+            raise JobError(f"'trackspath' should be a directory of sound files or a ChunkBank directory (trackspath='{dp}')")
+        key = ("corpus", str(dp), precision)
+        with self.key_lock(key):
+            signature = corpus_signature(dp)
+            with self.lock:
+                resident = self.corpora.get(key)
+                if resident is not None and resident[0] == signature:
+                    self.corpora.move_to_end(key)
+                    return resident[1], True
+            policy = DtypePolicy(precision, FORMAT_NATIVE)
+            if ChunkBank.is_bank(dp):
+                corpus = ChunkBank.read(dp, policy).to_mono()
+            elif cache_dir is not None:
+                corpus = CorpusCache(cache_dir).read_dir(dp, nchannels=1, policy=policy)
+            else:
+                corpus = TrackList.read_from_dir(dp, policy).to_mono()
+            with self.lock:
+                self.corpora[key] = (signature, corpus)
+                self.corpora.move_to_end(key)
+                while len(self.corpora) > self.max_corpora:
+                    self.corpora.popitem(last=False)
+            return corpus, False
+
+    def get_envelopes(self, fp: str|Path) -> Tuple[EnvelopeList, bool]:
+        """
+        :returns: the resident EnvelopeList read from `fp`, and whether it was already resident
+        """
+        fp = fp_to_abs(fp).resolve()
+        key = ("envelopes", str(fp))
+        with self.key_lock(key):
+            st = fp.stat()
+            signature = (st.st_mtime_ns, st.st_size)
+            resident = self.envelopes.get(str(fp))
+            if resident is not None and resident[0] == signature:
+                return resident[1], True
+            envlist = EnvelopeList.read(fp)
+            self.envelopes[str(fp)] = (signature, envlist)
+            return envlist, False
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "corpora": [
+                    { "trackspath": k[1], "precision": k[2], "nchunks": len(c[1]) }
+                    for k, c in self.corpora.items()
+                ],
+                "max_corpora": self.max_corpora,
+                "envelopes": [ { "path": k, "nenvelopes": len(e[1]) } for k, e in self.envelopes.items() ]
+            }
+
+
+class RenderServer:
+
+    def __init__(self, nworkers: int|None = None, max_queue: int = SERVE_QUEUE, max_corpora: int = SERVE_MAX_CORPORA):
+        """
+        run split and splice jobs on a bounded pool of `nworkers` threads, using the corpora kept resident by a WarmStore.
+
+        at most `nworkers` jobs run at once and at most `max_queue` jobs wait for a worker:
+        jobs submitted when the queue is full are rejected (see `QueueFullError`) instead of piling up.
+        numpy releases the GIL during the heavy operations (mixing, resampling, file I/O), so jobs run concurrently.
+
+        :param nworkers: number of worker threads (defaults to the number of CPUs)
+        :param max_queue: maximum number of jobs waiting for a worker
+        :param max_corpora: maximum number of resident corpora (see `WarmStore`)
+        """
+        self.nworkers = (os.cpu_count() or 1) if nworkers is None else nworkers
+        if self.nworkers < 1:
+            raise ValueError(f"invalid value for 'nworkers': expected an int >= 1, got '{nworkers}'")
+        if max_queue < 0:
+            raise ValueError(f"invalid value for 'max_queue': expected an int >= 0, got '{max_queue}'")
+        self.store = WarmStore(max_corpora)
+        self.executor = ThreadPoolExecutor(max_workers=self.nworkers, thread_name_prefix="aura_job")
+        self.slots = threading.BoundedSemaphore(self.nworkers + max_queue)
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.counts = { "running": 0, "done": 0, "failed": 0, "rejected": 0 }
+
+    def submit(self, type_: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        run a job and wait for its result.
+
+        :param type_: "split" or "splice"
+        :param params: parameters of the job: the parameters of `Split` or `Splice`, by name
+        :returns: { "type", "outpaths", "warm", "timings": { "queue", "load", "run", "total" } } (durations in seconds)
+        """
+        if type_ not in JOB_TYPES:
+            raise JobError(f"invalid job type: expected one of {JOB_TYPES}, got '{type_}'")
+        if not isinstance(params, dict):
+            raise JobError(f"job parameters should be a json object, got '{type(params).__name__}'")
+        params = { ("format_" if k == "format" else k): v for k, v in params.items() }
+        unknown = [ k for k in params if k not in JOB_PARAMS[type_] ]
+        if len(unknown):
+            raise JobError(f"unknown parameters for a {type_} job: {unknown}. expected: {JOB_PARAMS[type_]}")
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.counts["rejected"] += 1
+            raise QueueFullError(f"{self.nworkers} jobs are running and {self.max_queue} jobs are queued. retry later")
+        try:
+            t0 = time.perf_counter()
+            run: Callable = self.run_split if type_ == JOB_SPLIT else self.run_splice
+            return self.executor.submit(run, params, t0).result()
+        finally:
+            self.slots.release()
+
+    def run_job(self, run: Callable[[], Tuple[List[str], bool, float]], t0: float) -> Dict[str, Any]:
+        """run a job in a worker thread and time it. validation errors (`SystemExit`, see `validate_pretty`) are raised as `JobError`"""
+        t_start = time.perf_counter()
+        with self.lock:
+            self.counts["running"] += 1
+        try:
+            outpaths, warm, t_load = run()
+        except SystemExit as e:
+            with self.lock:
+                self.counts["failed"] += 1
+            raise JobError(getattr(e, "message", "invalid job parameters (see the server log)")) from None
+        except Exception:
+            with self.lock:
+                self.counts["failed"] += 1
+            raise
+        finally:
+            with self.lock:
+                self.counts["running"] -= 1
+        t_end = time.perf_counter()
+        with self.lock:
+            self.counts["done"] += 1
+        return {
+            "outpaths": outpaths,
+            "warm": warm,
+            "timings": {
+                "queue": t_start - t0,
+                "load": t_load - t_start,
+                "run": t_end - t_load,
+                "total": t_end - t0
+            }
+        }
+
+    def run_split(self, params: Dict[str, Any], t0: float) -> Dict[str, Any]:
+        def run():
+            # the input track is memory-mapped (see `Split`): there is nothing to keep resident
+            t_load = time.perf_counter()
+            split = Split(**params).pipeline()
+            failed = set( str(fp) for fp, _ in split.write_errors )
+            outpaths = [ str(split.to_outpath(i)) for i in range(split.nchunks) ]
+            return [ fp for fp in outpaths if fp not in failed ], False, t_load
+        return { "type": JOB_SPLIT, **self.run_job(run, t0) }
+
+    def run_splice(self, params: Dict[str, Any], t0: float) -> Dict[str, Any]:
+        def run():
+            if "trackspath" not in params:
+                raise JobError("missing parameter for a splice job: 'trackspath'")
+            chunks, warm = self.store.get_corpus(
+                params["trackspath"],
+                params.get("precision", "float32"),
+                params.get("cache_dir")
+            )
+            kwargs = params
+            envelope = params.get("envelope", ENV_NONE)
+            if isinstance(envelope, str) and envelope != ENV_RANDOM:
+                envlist, warm_env = self.store.get_envelopes(envelope)
+                kwargs = { **params, "envelope": envlist }
+                warm = warm and warm_env
+            t_load = time.perf_counter()
+            splice = Splice(chunks=chunks, **kwargs).pipeline()
+            return [ str(splice.outpath) ], warm, t_load
+        return { "type": JOB_SPLICE, **self.run_job(run, t0) }
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            counts = dict(self.counts)
+        return { "nworkers": self.nworkers, "max_queue": self.max_queue, "jobs": counts, **self.store.status() }
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    json over http:
+    - `POST /split` and `POST /splice`: run a job. the body is a json object of job parameters,
+      sent with the header `Content-Type: application/json`
+    - `GET /status`: workers, job counts and resident corpora
+
+    if the server has a token, all requests must send it in the header `Authorization: Bearer <token>`
+    """
+    server: "HTTPRenderServer|UnixRenderServer"  # pyright: ignore
+
+    def send_json(self, code: int, data: Dict[str, Any]) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self) -> bool:
+        """check the token of the request, if the server has one. if it is missing or wrong, a 401 response is sent"""
+        if self.server.token is None:
+            return True
+        scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), self.server.token.encode()):
+            return True
+        self.send_json(401, { "error": "missing or invalid token. expected the header 'Authorization: Bearer <token>'" })
+        return False
+
+    def do_GET(self) -> None:
+        if not self.authorized():
+            return
+        if self.path.rstrip("/") == "/status":
+            self.send_json(200, self.server.render_server.status())
+        else:
+            self.send_json(404, { "error": f"unknown path '{self.path}'. expected: '/status'" })
+
+    def do_POST(self) -> None:
+        if not self.authorized():
+            return
+        type_ = self.path.strip("/")
+        if type_ not in JOB_TYPES:
+            self.send_json(404, { "error": f"unknown path '{self.path}'. expected one of: {[ '/' + t for t in JOB_TYPES ]}" })
+            return
+        if self.headers.get_content_type() != "application/json":
+            self.send_json(415, { "error": f"unsupported content type '{self.headers.get_content_type()}'. expected 'application/json'" })
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self.send_json(400, { "error": f"invalid json body: {e}" })
+            return
+        try:
+            self.send_json(200, self.server.render_server.submit(type_, params))
+        except (JobError, FileExistsError, FileNotFoundError, TypeError, ValueError) as e:
+            self.send_json(400, { "error": str(e) })
+        except QueueFullError as e:
+            self.send_json(503, { "error": str(e) })
+        except Exception as e:
+            self.send_json(500, { "error": repr(e) })
+
+    def address_string(self) -> str:
+        # the client address of a unix socket is an empty string
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+class HTTPRenderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], render_server: RenderServer, token: str|None = None):
+        self.render_server = render_server
+        self.token = token
+        super().__init__(address, RequestHandler)
+
+
+class UnixRenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str|Path, render_server: RenderServer, token: str|None = None):
+        self.render_server = render_server
+        self.token = token
+        super().__init__(str(path), RequestHandler)
+
+    def server_bind(self) -> None:
+        # `BaseHTTPRequestHandler` expects the attributes set by `HTTPServer.server_bind`
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def serve(
+    port: int = SERVE_PORT,
+    socket_path: str|Path|None = None,
+    nworkers: int|None = None,
+    max_queue: int = SERVE_QUEUE,
+    preload: List[str|Path]|None = None,
+    max_corpora: int = SERVE_MAX_CORPORA,
+    token: str|None = None
+) -> None:
+    """
+    run the render daemon until it is interrupted (ctrl+c).
+
+    jobs are received as json over http, on localhost:`port` or on the unix socket `socket_path` (see `RequestHandler`).
+    relative paths in jobs are relative to the working directory of the daemon. jobs can't overwrite existing files.
+
+    >>> curl -X POST localhost:8765/splice -H 'Content-Type: application/json' -d '{"trackspath": "/data/chunks", "outpath": "/data/out.wav", "length": 10}'
+    >>> curl --unix-socket /tmp/aura.sock localhost/status
+
+    :param port: localhost port. unused if `socket_path` is provided
+    :param socket_path: path to a unix socket. it is removed when the daemon stops
+    :param nworkers: number of jobs run at once (see `RenderServer`)
+    :param max_queue: maximum number of jobs waiting for a worker
+    :param preload: corpora directories to load before accepting jobs
+    :param max_corpora: maximum number of resident corpora (see `WarmStore`)
+    :param token: if provided, requests must send it in the header `Authorization: Bearer <token>` (see `RequestHandler`)
+    """
+    render_server = RenderServer(nworkers, max_queue, max_corpora)
+    for dp in preload or []:
+        t0 = time.perf_counter()
+        render_server.store.get_corpus(dp)
+        print(f"loaded corpus '{fp_to_abs(dp)}' ({time.perf_counter() - t0:.2f}s)")
+
+    if socket_path is not None:
+        socket_path = fp_to_abs(socket_path)
+        if socket_path.exists():
+            if not socket_path.is_socket():
+                raise FileExistsError(f"'{socket_path}' exists and is not a socket")
+            socket_path.unlink()
+        server = UnixRenderServer(socket_path, render_server, token)
+        address = f"unix socket '{socket_path}'"
+    else:
+        server = HTTPRenderServer((SERVE_HOST, port), render_server, token)
+        address = f"http://{SERVE_HOST}:{port}"
+
+    print(f"aura serve: listening on {address} with {render_server.nworkers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        render_server.close()
+        if socket_path is not None and Path(socket_path).is_socket():
+            Path(socket_path).unlink()
+        print("aura serve: stopped")
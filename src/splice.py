@@ -1,19 +1,102 @@
-from typing import Literal, List, Tuple, Any
+from typing import Literal, List, Tuple, Iterator, Dict, Any
 from pathlib import Path
+import tempfile
+import copy
+import time
+import os
+
+import numpy as np
 
 from src.utils.validate import validate_type, validate_comparison, validate_isinlist, validate_float_isinrange, validate_pretty
-from src.utils.io_op import check_exists_file
-from src.utils.utils import seconds_to_frame
-from src.track import Track, TrackList
-from src.envelope import Envelope, EnvelopeList
+from src.utils.io_op import check_exists_file, WavStreamWriter
+from src.utils.parallel import process_map_summaries
+from src.utils.utils import seconds_to_frame, trailing_zeroes, make_rng, spawn_seeds, full_scale, Seed
+from src.track import Track, TrackList, DtypePolicy, FORMAT_NATIVE, to_nchannels
+from src.envelope import Envelope, EnvelopeList, EnvelopeBank, random_breakpoints
+from src.corpus import CorpusCache, ChunkBank
+from src.plan import SplicePlan
+from src.utils.profile import stage, CHUNK_POSITIONING, ENVELOPE, MIX
+from src.constants import NO_SILENCE, ENV_RANDOM, ENV_NONE, PAN_CONSTANT_POWER, PAN_LINEAR, PAN_LAWS
+
+BATCH_SIZE = 1024  # number of chunks that are enveloped and mixed at once
+
+
+def pan_gains(positions: np.ndarray, law: str = PAN_CONSTANT_POWER, dtype: np.dtype|type = np.float32) -> np.ndarray:
+    """
+    convert pan positions into left/right gains, in a single vectorized operation.
+
+    :param positions: array of shape (n,) of pan positions, from -1 (left) to 1 (right). 0 is the center
+    :param law: how the volume is split between both channels
+        - "constant-power": `(cos(a), sin(a))` with `a` from 0 to pi/2: the perceived loudness is the same at all
+          positions (a centered chunk is played at -3dB on both channels)
+        - "linear": `((1-p)/2, (1+p)/2)`: the gains add up to 1 (a centered chunk is played at -6dB on both channels, like `Track.to_stereo`)
+    :returns: array of shape (n, 2) of left/right gains
+    """
+    if law == PAN_CONSTANT_POWER:
+        angles = (positions + 1) * (np.pi / 4)
+        gains = np.stack([ np.cos(angles), np.sin(angles) ], axis=1)
+    elif law == PAN_LINEAR:
+        gains = np.stack([ (1 - positions) / 2, (1 + positions) / 2 ], axis=1)
+    else:
+        raise ValueError(f"invalid pan law: expected one of {PAN_LAWS}, got '{law}'")
+    return gains.astype(dtype, copy=False)
+
+
+def fold_pattern(pattern: np.ndarray, repeat: int) -> np.ndarray:
+    """
+    fold a pattern that is repeated every `repeat` frames into periods of `repeat` frames.
+
+    the pattern is padded with silence to `q*repeat` frames and reshaped to `(q, repeat)`. the cumulative sum of
+    those rows is the overlay of all repetitions: row `m` is the overlay on frames `m*repeat` to `(m+1)*repeat`,
+    where the `m+1` first repetitions overlap. from row `q-1`, all overlapping repetitions are summed: the overlay
+    is periodic, and the last row is its period. if `repeat` is longer than the pattern, `q == 1` and there is no overlap.
+
+    :param pattern: array of shape (x,) (mono) or (x, nchannels)
+    :param repeat: interval between the start of 2 repetitions, in frames
+    :returns: array of shape (q, repeat) (mono) or (q, repeat, nchannels)
+    """
+    q = max(-(-pattern.shape[0] // repeat), 1)
+    padded = np.zeros((q * repeat, *pattern.shape[1:]), dtype=pattern.dtype)
+    padded[:pattern.shape[0]] = pattern
+    return np.cumsum(padded.reshape(q, repeat, *pattern.shape[1:]), axis=0)
+
+
+def overlay_pattern(mix: np.ndarray, folded: np.ndarray, start: int = 0) -> np.ndarray:
+    """
+    add a repeated pattern to `mix` in place, with a single pass over `mix` and no loop over repetitions.
+
+    :param mix: frames `start` to `start+len(mix)` of the output track. must be contiguous
+    :param folded: the folded pattern (see `fold_pattern`)
+    :param start: position of `mix` in the output track, in frames
+    """
+    repeat = folded.shape[1]
+    head = folded[:-1].reshape(-1, *folded.shape[2:])  # frames 0 to (q-1)*repeat of the overlay
+    period = folded[-1]  # the overlay is periodic after the head
+    end = start + mix.shape[0]
+
+    # frames in the head: a plain slice
+    head_end = min(end, head.shape[0])
+    if start < head_end:
+        mix[:head_end-start] += head[start:head_end]
+
+    # periodic frames: a partial period to align on `repeat`, then whole periods in bulk, then a partial period
+    periodic = mix[max(start, head.shape[0]) - start:]
+    if periodic.shape[0]:
+        phase = max(start, head.shape[0]) % repeat
+        first = min(repeat - phase, periodic.shape[0])
+        periodic[:first] += period[phase:phase+first]
+        rest = periodic[first:]
+        nperiods = rest.shape[0] // repeat
+        periods = rest[:nperiods*repeat].reshape(nperiods, repeat, *rest.shape[1:])  # a view on `mix`
+        periods += period
+        tail = rest[nperiods*repeat:]
+        tail += period[:tail.shape[0]]
+    return mix
 
-NO_SILENCE = "no-silence"
-ENV_RANDOM = "random"
-ENV_NONE = None
 
 class Splice:
 
-    chunks: TrackList
+    chunks: TrackList|ChunkBank
     outpath: Path
     length: int
     nimpulses: int|Literal["NO_SILENCE"]
@@ -21,39 +104,96 @@ class Splice:
     nchannels: int
     width: float
     mode: int|Literal["range"]
+    pan_law: str
     pattern: Track|None
-    patter_repeat: int
+    pattern_repeat: int|None
     overwrite: bool
     rate: int
+    dtype: np.dtype
+    policy: DtypePolicy
+    block_size: int|None
+    rng: np.random.Generator
+    plan: SplicePlan|None
 
     def __init__(
         self,
         trackspath:str|Path,
         outpath:str|Path,
-        length:float,
+        length:float|None=None,
         nimpulses:int|Literal["NO_SILENCE"]=NO_SILENCE,  # pyright:ignore
-        envelope:str|None=ENV_NONE,
+        envelope:str|EnvelopeList|None=ENV_NONE,
         nchannels:Literal[1,2]=2,
         width:float=1,
         mode:Literal[2,3,"range"]=2,
         pattern:str|None=None,
         repeat:float|None=10,
-        overwrite:bool=False
+        overwrite:bool=False,
+        block:float|None=None,
+        cache_dir:str|Path|None=None,
+        precision:Literal["float32","float64"]="float32",
+        format_:str=FORMAT_NATIVE,
+        seed:Seed=None,
+        pan_law:str=PAN_CONSTANT_POWER,
+        chunks:TrackList|ChunkBank|None=None,
+        plan:SplicePlan|str|Path|None=None
     ):
+        """
+        :param block: if provided, the output track is rendered and written to disk in blocks of `block` seconds,
+            so that memory usage does not depend on the length of the output track. if None, the output track is rendered in memory.
+        :param cache_dir: if provided, the decoded, resampled and mono chunks in `trackspath` are cached in `cache_dir` (see `CorpusCache`)
+        :param precision: float dtype used to process the chunks (see `DtypePolicy`)
+        :param format_: sample format of the output track. if "native", the dtype of the input chunks (see `DtypePolicy`)
+        :param seed: seed of the random generator used for all random decisions (chunks, envelopes, positions).
+            two runs with the same seed and inputs generate the same output. if None, the output is not reproducible
+        :param pan_law: how a chunk's volume is split between the left and right channels (see `pan_gains`)
+        :param chunks: chunks already loaded, resampled and converted to mono (see `src.serve`). if provided,
+            `trackspath` and `cache_dir` are not read. `chunks` is not modified: it can be shared by several Splices
+        :param envelope: None, "random", a path to an envelope file or an EnvelopeList. an EnvelopeList is not modified
+        :param plan: a plan made by `Splice.make_plan`, or a path to a saved plan (see `SplicePlan`). if provided,
+            the plan is rendered instead of a new one: `length`, `nchannels` and the parameters of the random decisions
+            (`nimpulses`, `envelope`, `width`, `mode`, `pan_law`, `seed`) are ignored. if `trackspath` is a directory
+            of sound files and `cache_dir` is None, only the chunks played by the plan are read.
+
+        NOTE: `trackspath` can be a directory of sound files or a ChunkBank directory (see `ChunkBank`)
+        """
         # validate data
         overwrite = validate_pretty("overwrite", validate_type, i=overwrite, type_=bool)
-        chunks = TrackList.read_from_dir(trackspath)
+        policy = validate_pretty("precision/format", DtypePolicy, precision, format_)
+        rng = validate_pretty("seed", make_rng, seed)
+        if plan is not None and not isinstance(plan, SplicePlan):
+            plan = validate_pretty("plan", SplicePlan.load, plan)
+        if chunks is not None:
+            # shallow copy with its own random generator: the chunks' data is shared, not copied
+            chunks = copy.copy(chunks)
+            chunks.rng = rng
+        elif ChunkBank.is_bank(trackspath):
+            chunks = ChunkBank.read(trackspath, policy, rng)
+            chunks.to_mono()
+        elif cache_dir is not None:
+            chunks = CorpusCache(cache_dir).read_dir(trackspath, nchannels=1, policy=policy, rng=rng)
+        elif plan is not None:
+            plan = plan.compact()
+            chunks = plan.read_chunks(policy, rng)
+        else:
+            # NOTE: all tracks are converted to mono: the mono chunks will be placed in stereo space
+            chunks = TrackList.read_from_dir(trackspath, policy, rng).to_mono()
         outpath, exists = check_exists_file(outpath, overwrite)
-        pattern_chunk = Track.read(pattern) if pattern is not None else None
+        pattern_chunk = Track.read(pattern, policy=policy) if pattern is not None else None
+        if plan is not None:
+            validate_pretty("plan", plan.check_chunks, chunks)
+            length, nchannels = plan.length / plan.rate, plan.nchannels
         length = validate_pretty("length", validate_type, i=length, type_=float)
-        try:
+        if nimpulses != NO_SILENCE:
             nimpulses = validate_pretty("nimpulses", validate_type, i=nimpulses, type_=int)
-        except ValueError:
-            validate_pretty("nimpulses", validate_comparison, "eq", a=nimpulses, b=NO_SILENCE)
+            validate_pretty("nimpulses", validate_comparison, "ge", a=nimpulses, b=0)
         #NOTE mode has no effect if 'nchannels' != 2
         validate_pretty("mode", validate_isinlist, i=mode, vallist=[2,3,"range"])
         validate_pretty("nchannels", validate_isinlist, i=nchannels, vallist=[1,2])
         validate_pretty("width", validate_float_isinrange, i=width, min_=0, max_=1, inclusive=True)
+        validate_pretty("pan_law", validate_isinlist, i=pan_law, vallist=PAN_LAWS)
+        if block is not None:
+            block = validate_pretty("block", validate_type, i=block, type_=float)
+            validate_pretty("block", validate_comparison, "gt", a=block, b=0)
 
         if nchannels == 1:
             width = 0.
@@ -62,10 +202,15 @@ class Splice:
             repeat = validate_pretty("repeat", validate_type, i=repeat, type_=float)
         elif pattern is not None:
             repeat = 10.0
+        if pattern is not None:
+            validate_pretty("repeat", validate_comparison, "gt", a=repeat, b=0)
 
-        if envelope != ENV_RANDOM and envelope != ENV_NONE:
+        if isinstance(envelope, EnvelopeList):
+            envelope_data = copy.copy(envelope)
+            envelope_data.rng = rng
+        elif envelope != ENV_RANDOM and envelope != ENV_NONE:
             try:
-                envelope_data = EnvelopeList.read(envelope)  # pyright: ignore
+                envelope_data = EnvelopeList.read(envelope, rng)  # pyright: ignore
             except Exception as e:
                 raise e
                 print(f"could not read envelopes from file: {envelope}. File should contain the output of Envelope.to_dict()")
@@ -73,40 +218,351 @@ class Splice:
         else:
             envelope_data = envelope
 
-        # NOTE: all tracks are converted to mono: the mono chunks will be placed in stereo space
-        self.chunks = chunks.resample().to_mono()
+        self.chunks = chunks
         self.outpath = outpath
-        self.length = seconds_to_frame(length, chunks.rate)
+        self.length = seconds_to_frame(length, chunks.rate) if plan is None else plan.length
         self.nimpulses = nimpulses
         self.envelope = envelope_data  # pyright: ignore
         self.nchannels = nchannels
         self.width = width
         self.mode = mode
+        self.pan_law = pan_law
         self.pattern = pattern_chunk
-        self.pattern_repeat = seconds_to_frame(repeat, chunks.rate)  # pyright:ignore
+        self.pattern_repeat = max(seconds_to_frame(repeat, chunks.rate), 1) if repeat is not None else None
         self.overwrite = overwrite
         self.rate = chunks.rate
+        self.dtype = chunks.dtype if plan is None else plan.dtype  # native dtype of the input chunks
+        self.policy = policy
+        self.block_size = max(seconds_to_frame(block, chunks.rate), 1) if block is not None else None
+        self.rng = rng
+        self.plan = plan
         return
 
-    def get_chunk_apply_env(self) -> Track:
+    def make_breakpoints(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
         """
-        1. select a chunk and apply an env to it
-        NOTE: chunks and envs are selected and applied at random.
+        select the envelopes to apply to `n` chunks.
+
+        :returns: the index of each envelope in `self.envelope` (-1 if the envelopes are random or there are no envelopes)
+            and the breakpoint matrix of each envelope, of shape (n,2,5) (NaN if there are no envelopes)
         """
-        chunk = self.chunks.get_one()
+        ids = np.full(n, -1, dtype=np.int64)
         if self.envelope == ENV_NONE:
-            return chunk
+            breakpoints = np.full((n, 2, 5), np.nan)
         elif self.envelope == ENV_RANDOM:
-            return Envelope.random().apply(chunk)
+            breakpoints = random_breakpoints(n, self.rng)
         elif isinstance(self.envelope, EnvelopeList):
-            return self.envelope.get_one().apply(chunk)
+            ids = self.rng.integers(len(self.envelope), size=n)
+            breakpoints = self.envelope.breakpoints[ids]
         else:
             raise ValueError(f"error selecting envelope strategy. `Splice.envelope` should be `None`, `'random'` or `EnvelopeList`, but is: {type(self.envelope)}")
+        return ids, breakpoints
+
+    def make_impulses(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        select the chunks to play and the position of the impulses that trigger them.
+        - if `self.nimpulses` is an int, `nimpulses` chunks are placed at random positions in the output track.
+        - if `self.nimpulses == NO_SILENCE`, chunks are placed one after the other until the output track is filled:
+          the start of each impulse is the cumulative sum of the lengths of the previous chunks. chunks are drawn
+          in batches large enough to fill the output track on average, so there are usually 1 or 2 batches.
+
+        :returns: the start frame of each impulse in the output track and the index of the chunk played by each impulse
+        """
+        if self.nimpulses != NO_SILENCE:
+            starts = self.rng.integers(0, self.length, self.nimpulses)  # pyright: ignore
+            return starts, self.rng.integers(len(self.chunks), size=self.nimpulses)  # pyright: ignore
+
+        lengths = self.chunks.lengths
+        if lengths.max() == 0:
+            raise ValueError("cannot fill the output track with empty chunks")
+        ids, ends = [], []
+        position = 0
+        while position < self.length:
+            n = int(np.ceil((self.length - position) / lengths.mean() * 1.1)) + 16
+            batch = self.rng.integers(len(lengths), size=n)
+            batch_ends = position + np.cumsum(lengths[batch])
+            # the last impulse is the first one that reaches the end of the output track
+            last = min(int(np.searchsorted(batch_ends, self.length)), n-1)
+            ids.append(batch[:last+1])
+            ends.append(batch_ends[:last+1])
+            position = int(batch_ends[last])
+        if not len(ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        ends = np.concatenate(ends)
+        return np.concatenate([ [0], ends[:-1] ]).astype(np.int64), np.concatenate(ids)
+
+    def make_gains(self, n: int) -> np.ndarray|None:
+        """
+        place `n` impulses in stereo space: compute the left/right gains of all impulses at once.
+        - if `self.mode == 2`, chunks are panned to the left or the right, at `self.width`
+        - if `self.mode == 3`, chunks are panned to the left, the center or the right, at `self.width`
+        - if `self.mode == "range"`, chunks are panned at a random position between `-self.width` and `self.width`
 
-    def pipeline(self):
-        # NOTE: envs successfully applied !
-        # TODO: position chunks in space !
-        for _ in self.chunks.tracklist:
-            self.get_chunk_apply_env()
+        :returns: an array of shape (n, 2) of left/right gains (see `pan_gains`), or None if the output track is mono
+        """
+        if self.nchannels == 1:
+            return None
+        if self.mode == 2:
+            positions = self.rng.choice(np.array([-1., 1.]), size=n)
+        elif self.mode == 3:
+            positions = self.rng.choice(np.array([-1., 0., 1.]), size=n)
+        else:
+            positions = self.rng.uniform(-1., 1., size=n)
+        return pan_gains(positions * self.width, self.pan_law, self.policy.precision)
+
+    def make_pattern(self) -> np.ndarray|None:
+        """
+        convert `self.pattern` to the rate, number of channels, dtype and scale of the output track, and fold it
+        into periods of `self.pattern_repeat` frames (see `fold_pattern`).
+
+        :returns: the folded pattern, or None if there is no pattern
+        """
+        if self.pattern is None or self.pattern_repeat is None:
+            return None
+        pattern = self.pattern.resample(self.rate)
+        data = self.policy.to_float(to_nchannels(pattern.get_data(), self.nchannels, self.policy.precision))
+        # the mix keeps the scale of the chunks' native dtype (see `DtypePolicy`): the pattern is converted to that scale
+        (scale_in, offset_in), (scale_out, _) = full_scale(pattern.native_dtype), full_scale(self.dtype)
+        if scale_in != scale_out or offset_in != 0:
+            data = (data - offset_in) * (scale_out / scale_in)
+        return fold_pattern(data.astype(self.policy.precision, copy=False), self.pattern_repeat)
+
+    def make_plan(self) -> SplicePlan:
+        """
+        make all the random decisions of the output track at once: the chunks, their positions,
+        their envelopes and their positions in stereo space. the plan can be rendered (see `Splice.render`)
+        or saved to be rendered later (see `SplicePlan.save`).
+        """
+        with stage(CHUNK_POSITIONING):
+            starts, chunk_ids = self.make_impulses()
+            gains = self.make_gains(len(chunk_ids))
+        envelope_ids, breakpoints = self.make_breakpoints(len(chunk_ids))
+        timeline = SplicePlan.empty(len(chunk_ids))
+        timeline["start"] = starts
+        timeline["chunk"] = chunk_ids
+        timeline["envelope"] = envelope_ids
+        timeline["breakpoints"] = breakpoints
+        if gains is not None:
+            timeline["gains"] = gains
+        return SplicePlan(timeline, self.rate, self.length, self.nchannels, self.dtype, self.chunks.trackpaths)
+
+    def get_plan(self) -> SplicePlan:
+        """the plan provided to `Splice`, or a new plan"""
+        return self.plan if self.plan is not None else self.make_plan()
+
+    def render(self, plan: SplicePlan|None = None) -> np.ndarray:
+        """
+        mix the chunks into the output track, following `plan` (defaults to `Splice.get_plan`).
+
+        the output track is preallocated once, and each enveloped chunk is added to it
+        at its impulse position (overlap-add), writing directly into a slice of the output.
+        chunks that exceed the length of the output track are truncated.
+        envelopes are applied to `BATCH_SIZE` chunks at once.
+        the pattern, if any, is then added at all its repetitions at once (see `overlay_pattern`).
+
+        :returns: an array of shape (self.length,) (mono) or (self.length, 2) (stereo)
+        """
+        plan = self.get_plan() if plan is None else plan
+        shape = (plan.length,) if plan.nchannels == 1 else (plan.length, plan.nchannels)
+        mix = np.zeros(shape, dtype=self.policy.precision)
+        gains = plan.timeline["gains"].astype(self.policy.precision) if plan.nchannels == 2 else None
+        if gains is not None and len(plan):
+            # the panned frames of each impulse are written to a single buffer, sized to the longest chunk played
+            longest = min(int(self.chunks.lengths[plan.timeline["chunk"]].max()), plan.length)
+            scratch = np.empty((longest, plan.nchannels), dtype=self.policy.precision)
+        pattern = self.make_pattern()
+        # envelopes picked from an EnvelopeList are a fixed set: their multipliers are cached
+        cache = self.envelope.cache if isinstance(self.envelope, EnvelopeList) else None
+
+        with stage(MIX):
+            for i in range(0, len(plan), BATCH_SIZE):
+                rows = plan.timeline[i:i+BATCH_SIZE]
+                batch = [ self.chunks.get(c) for c in rows["chunk"] ]
+                enveloped = np.flatnonzero(~np.isnan(rows["breakpoints"][:, 0, 0]))
+                if len(enveloped):
+                    bank = EnvelopeBank.from_breakpoints(rows["breakpoints"][enveloped], cache)
+                    for j, chunk in zip(enveloped, bank.apply([ batch[j] for j in enveloped ])):
+                        batch[j] = chunk
+                for j, (start, chunk) in enumerate(zip(rows["start"], batch), start=i):
+                    end = min(start + chunk.nframes, plan.length)
+                    data = chunk.get_frames(0, end-start)
+                    if gains is None:
+                        mix[start:end] += data
+                    else:
+                        panned = np.multiply(data[:, np.newaxis], gains[j], out=scratch[:end-start])  # the mono chunk is panned in a single multiply
+                        mix[start:end] += panned
+            if pattern is not None:
+                overlay_pattern(mix, pattern)
+        return mix
+
+    def render_blocks(self, block_size: int, plan: SplicePlan|None = None) -> Iterator[np.ndarray]:
+        """
+        mix the chunks into the output track, block by block, following `plan` (defaults to `Splice.get_plan`).
+
+        the timeline is processed in consecutive blocks of `block_size` frames. for each block,
+        only the impulses that overlap it are mixed, and the envelopes are only computed for the
+        overlapping frames. chunks are never copied as a whole, so memory usage depends on `block_size`
+        and not on the length of the output track. the repetitions of the pattern that overlap a block are added to it at once.
+
+        NOTE: the same buffer is reused for all blocks: a block must be consumed before the next one is generated.
+
+        :yields: arrays of shape (<=block_size,) (mono) or (<=block_size, 2) (stereo)
+        """
+        plan = self.get_plan() if plan is None else plan
+        shape = (block_size,) if plan.nchannels == 1 else (block_size, plan.nchannels)
+        block = np.empty(shape, dtype=self.policy.precision)
+        starts, chunk_ids = plan.timeline["start"], plan.timeline["chunk"]
+        gains = plan.timeline["gains"].astype(self.policy.precision) if plan.nchannels == 2 else None
+        scratch = np.empty(shape, dtype=self.policy.precision) if gains is not None else None  # panned frames of an impulse in the current block
+        envelopes = [
+            None if np.isnan(bp[0, 0]) else Envelope.from_breakpoints(bp)
+            for bp in plan.timeline["breakpoints"]
+        ]
+        pattern = self.make_pattern()
+        order = np.argsort(starts, kind="stable")  # impulses sorted by start position
+
+        active: List[int] = []  # impulses that overlap the current block
+        nxt = 0  # position in `order` of the next impulse to activate
+        for block_start in range(0, plan.length, block_size):
+            with stage(MIX):
+                block_end = min(block_start + block_size, plan.length)
+                mix = block[:block_end-block_start]
+                mix.fill(0)
+                while nxt < len(order) and starts[order[nxt]] < block_end:
+                    active.append(order[nxt])
+                    nxt += 1
+
+                still_active = []
+                for i in active:
+                    start, chunk, envelope = starts[i], self.chunks.get(chunk_ids[i]), envelopes[i]
+                    end = start + chunk.nframes
+                    # overlap between the chunk and the block, relative to the start of the chunk
+                    lo, hi = max(block_start, start) - start, min(block_end, end) - start
+                    if hi > lo:
+                        data = chunk.get_frames(lo, hi)
+                        if envelope is not None:
+                            with stage(ENVELOPE):
+                                data = data * envelope.make_multiplier(chunk.nframes, self.policy.precision, lo, hi)
+                        if gains is None:
+                            mix[start+lo-block_start:start+hi-block_start] += data
+                        else:
+                            panned = np.multiply(data[:, np.newaxis], gains[i], out=scratch[:hi-lo])
+                            mix[start+lo-block_start:start+hi-block_start] += panned
+                    if end > block_end:
+                        still_active.append(i)
+                active = still_active
+                if pattern is not None:
+                    overlay_pattern(mix, pattern, block_start)
+            yield mix
+
+    def stream(self, plan: SplicePlan|None = None) -> "Splice":
+        """render the output track block by block and append each block to `self.outpath`"""
+        if self.block_size is None:
+            raise ValueError("expected a block size to stream the output track, got 'None'")
+        plan = self.get_plan() if plan is None else plan
+        dtype = self.dtype if self.policy.format is None else self.policy.format
+        with WavStreamWriter(self.outpath, self.rate, plan.nchannels, dtype, plan.length) as writer:
+            for mix in self.render_blocks(self.block_size, plan):
+                writer.write(self.policy.to_output(mix, self.dtype))
+        return self
+
+    def write(self, mix: np.ndarray) -> "Splice":
+        """write the output track to `self.outpath`. it is converted to the output format once, when it is written"""
+        Track(self.rate, mix, self.outpath, self.policy, self.dtype).write()
+        return self
+
+    def pipeline(self, plan: SplicePlan|None = None):
+        """
+        render `plan` (defaults to `Splice.get_plan`) and write it to `self.outpath`
+        """
+        plan = self.get_plan() if plan is None else plan
+        if self.block_size is not None:
+            self.stream(plan)
+        else:
+            self.write(self.render(plan))
+        return self
+
+
+def variant_paths(outpath: str|Path, nvariants: int) -> List[Path]:
+    """numbered output paths of `nvariants` variants: `out.wav` => [ `out_1.wav`, `out_2.wav`... ]"""
+    outpath = Path(outpath)
+    return [
+        outpath.with_name(f"{outpath.stem}_{trailing_zeroes(i, nvariants)}{outpath.suffix}")
+        for i in range(1, nvariants+1)
+    ]
+
+
+def splice_one(trackspath: Path, outpath: Path, seed: int, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    render a single variant and return a summary of the render.
+    defined at module level so that it can be run in a worker process.
+    """
+    t0 = time.perf_counter()
+    Splice(trackspath=trackspath, outpath=outpath, overwrite=True, seed=seed, **kwargs).pipeline()
+    return { "outpath": str(outpath), "seed": seed, "time": time.perf_counter() - t0 }
+
+
+def splice_variants(
+    trackspath: str|Path,
+    outpath: str|Path,
+    nvariants: int,
+    nprocesses: int|None = None,
+    seed: int|None = None,
+    overwrite: bool = False,
+    cache_dir: str|Path|None = None,
+    precision: Literal["float32","float64"] = "float32",
+    **kwargs
+) -> List[Dict[str, Any]]:
+    """
+    render `nvariants` variants of the same splice, which only differ by their random decisions.
+
+    the chunks in `trackspath` are decoded, resampled and converted to mono once, and packed into a temporary
+    ChunkBank (see `ChunkBank`). the variants are rendered by a pool of worker processes that memory-map that
+    ChunkBank: the chunks are shared read-only by all workers through the OS page cache, and are never pickled.
+    if `trackspath` is already a ChunkBank, it is used as is.
+
+    each variant gets its own seed, derived from `seed` (see `spawn_seeds`), and is written to a numbered
+    output path (see `variant_paths`). a variant can be rendered again on its own with `Splice(..., seed=<its seed>)`.
+
+    :param nvariants: number of variants
+    :param nprocesses: number of worker processes (defaults to the number of CPUs). if 1, the variants are rendered in the current process
+    :param seed: seed from which the seeds of the variants are derived
+    :param cache_dir: cache of decoded chunks (see `CorpusCache`). only used to build the temporary ChunkBank
+    :param kwargs: other parameters passed to `Splice`
+    :returns: a summary of each variant, in order
+    """
+    nvariants = validate_pretty("variants", validate_type, i=nvariants, type_=int)
+    validate_pretty("variants", validate_comparison, "ge", a=nvariants, b=1)
+    policy = validate_pretty("precision/format", DtypePolicy, precision, kwargs.get("format_", FORMAT_NATIVE))
+    nprocesses = min(os.cpu_count() or 1, nvariants) if nprocesses is None else nprocesses
+    outpaths = [ check_exists_file(fp, overwrite)[0] for fp in variant_paths(outpath, nvariants) ]
+    # 32 bit integer seeds, that can be passed to `aura splice --seed`
+    seeds = [ int(s.generate_state(1)[0]) for s in spawn_seeds(seed, nvariants) ]
+    kwargs = { **kwargs, "precision": precision }
+
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="aura_variants_") as tmp:
+        if ChunkBank.is_bank(trackspath):
+            bank_dir = trackspath
+        else:
+            if cache_dir is not None:
+                tracklist = CorpusCache(cache_dir).read_dir(trackspath, nchannels=1, policy=policy)
+            else:
+                tracklist = TrackList.read_from_dir(trackspath, policy).to_mono()
+            ChunkBank.build(tracklist, tmp)
+            bank_dir = tmp
 
+        def describe(s: Dict[str, Any]) -> str:
+            status = f"failed: {s['error']}" if "error" in s else f"{s['time']:.2f}s"
+            return f"- '{s['outpath']}' (seed: {s['seed']}): {status}"
 
+        return process_map_summaries(
+            splice_one,
+            [ (bank_dir, fp, s, kwargs) for fp, s in zip(outpaths, seeds) ],
+            nprocesses,
+            on_error=lambda a: { "outpath": str(a[1]), "seed": a[2] },
+            header=lambda summaries: (
+                f"rendered {nvariants - len([ s for s in summaries if 'error' in s ])}/{nvariants} variants "
+                f"({time.perf_counter() - t0:.2f}s)"
+            ),
+            describe=describe
+        )
@@ -1,14 +1,17 @@
-from typing import Literal, List
+from typing import Literal, List, Tuple, Iterable, Dict, Any
 from pathlib import Path
+import time
 import re
 
 import numpy as np
-from scipy.stats import truncnorm
+from numpy.lib.stride_tricks import sliding_window_view
 
-from src.track import Track
-from src.utils.io_op import make_dir
-from src.utils.utils import seconds_to_frame, get_chunk_ends, trailing_zeroes
+from src.track import Track, DtypePolicy, FORMAT_NATIVE
+from src.utils.io_op import make_dir, fp_to_abs_validate, expand_trackpaths
+from src.utils.utils import seconds_to_frame, get_chunk_ends, trailing_zeroes, make_rng, spawn_seeds, Seed
 from src.utils.validate import validate_type, validate_isinlist, validate_comparison, validate_pretty
+from src.utils.parallel import thread_map_bounded, process_map_summaries
+from src.utils.profile import stage, CHUNK_POSITIONING
 
 class Split:
 
@@ -21,6 +24,11 @@ class Split:
     split_all: bool
     chunk_pos: np.ndarray
     chunks: List[Track]
+    batch: np.ndarray|None
+    batch_index: np.ndarray|None
+    nworkers: int
+    write_errors: List[Tuple[Path, Exception]]
+    rng: np.random.Generator
 
     def __init__(
         self,
@@ -30,11 +38,29 @@ class Split:
         dev: float | None = 0,
         nchunks: int | None = 0,
         nchannels: Literal[1,2] | None = None,
-        overwrite: bool = False
+        overwrite: bool = False,
+        mmap: bool = True,
+        nworkers: int = 4,
+        precision: Literal["float32","float64"] = "float32",
+        format_: str = FORMAT_NATIVE,
+        make_outpath: bool = True,
+        seed: Seed = None
     ):
+        """
+        :param mmap: memory-map the input track instead of loading it in RAM. only the
+            frames that are part of a chunk will be read from disk.
+        :param nworkers: number of threads used to write the chunks
+        :param precision: float dtype used when the chunks need processing (channel conversion) (see `DtypePolicy`)
+        :param format_: sample format of the output chunks. if "native", the dtype of the input track (see `DtypePolicy`)
+        :param make_outpath: create the `outpath` directory (removing its contents if `overwrite`).
+            if False, `outpath` must be an existing directory, and is used as is.
+        :param seed: seed of the random generator used to position the chunks. if None, chunk positions are not reproducible
+        """
         # validate data
-        track = Track.read(trackpath)
-        outpath = make_dir(outpath, overwrite)  # pyright: ignore
+        policy = validate_pretty("precision/format", DtypePolicy, precision, format_)
+        rng = validate_pretty("seed", make_rng, seed)
+        track = Track.read(trackpath, mmap, policy)
+        outpath = make_dir(outpath, overwrite) if make_outpath else fp_to_abs_validate(outpath)  # pyright: ignore
 
         length = validate_pretty("length", validate_type, i=length, type_=float)
         if nchunks is not None:
@@ -45,6 +71,8 @@ class Split:
         if nchannels is not None:
             nchannels = validate_pretty("nchannels", validate_type, i=nchannels, type_=int)
             validate_pretty("nchannels", validate_isinlist, i=nchannels, vallist=[1, 2])
+        nworkers = validate_pretty("nworkers", validate_type, i=nworkers, type_=int)
+        validate_pretty("nworkers", validate_comparison, opname="ge", a=nworkers, b=1)
 
         # define defaults and do conversions
         length = seconds_to_frame(length, track.rate)
@@ -54,10 +82,11 @@ class Split:
             nchunks = int(track.nframes / length)  # track length / splitted chunk length
         if nchannels is None:
             nchannels = 1 if track.nchannels == 1 else 2  # define default based on number of channels in input track
+        # channel conversion is deferred: it is only applied to the chunks, when they are written
         if nchannels == 1:
-            track = track.to_mono()
+            track = track.to_mono(lazy=True)
         else:
-            track = track.to_stereo()
+            track = track.to_stereo(lazy=True)
         # flag to split the entire track into consecutive chunks of lenght `length` if `nchunks * length` == `track.nframes`
         split_all = nchunks * length == track.nframes  # pyright:ignore .
 
@@ -68,12 +97,23 @@ class Split:
         self.dev = dev
         self.nchannels = nchannels
         self.split_all = split_all
+        self.nworkers = nworkers
+        self.write_errors = []
+        self.batch = None
+        self.batch_index = None
+        self.rng = rng
 
     def pipeline(self):
         """
-        split track into chunks
+        split track into chunks.
+        if all chunks have the same length (`dev == 0`), they are extracted as a single batch (see `Split.make_batch`)
         """
-        self.make_chunk_pos().make_chunks().write_chunks()
+        with stage(CHUNK_POSITIONING):
+            self.make_chunk_pos()
+        if self.has_equal_lengths():
+            self.make_batch().write_batch()
+        else:
+            self.make_chunks().write_chunks()
         return self
 
     def to_outpath(self, i:int) -> Path:
@@ -104,6 +144,8 @@ class Split:
         abs_to_std = lambda x: (x - self.length) / self.dev
 
         if self.dev > 0:
+            # scipy.stats is slow to import: it is only imported when it is needed
+            from scipy.stats import truncnorm
             min_ = abs_to_std(0)
             max_ = abs_to_std(2*self.length)
 
@@ -111,12 +153,13 @@ class Split:
                 min_, max_,
                 loc=self.length,
                 scale=self.dev,
-                size=self.nchunks
+                size=self.nchunks,
+                random_state=self.rng
             ))
             assert chunk_lengths[chunk_lengths < 0].shape[0] == 0
             assert chunk_lengths[chunk_lengths > 2*self.length].shape[0] == 0
         else:
-            chunk_lengths = np.array([self.length for _ in range(self.nchunks)])
+            chunk_lengths = np.full(self.nchunks, self.length)
 
         # 2: calculate chunk starting positions
         # if split_all, all chunks are successive. otherwise, chunks are positionned at random
@@ -128,12 +171,12 @@ class Split:
             max_chunk_end = chunk_ends[-1]  # last item is the end point of the last chunk
             chunk_starts = chunk_starts[:-1]  # remove the last item, since `chunk_starts` only keeps starting positions
         else:
-            chunk_starts = np.random.default_rng().integers(0, self.track.nframes, self.nchunks)
+            chunk_starts = self.rng.integers(0, self.track.nframes, self.nchunks)
             chunk_ends = get_chunk_ends(chunk_starts, chunk_lengths)  # pyright: ignore
             max_chunk_end = np.max(chunk_ends)
 
         # resize `chunk_*` if the last chunk end is higher than the track length (possible because of standard deviation)
-        if max_chunk_end > self.track.nframes - 1:
+        if max_chunk_end > self.track.nframes:  # chunk ends are exclusive: a chunk can end at `nframes`
             r = (self.track.nframes - 1) / max_chunk_end
             chunk_starts = np.rint(chunk_starts * r)  # rint = round to int
             chunk_lengths = np.rint(chunk_lengths * r)
@@ -153,25 +196,158 @@ class Split:
         """
         self.chunks = []
         for i, (start, end) in enumerate(self.chunk_pos):
-            chunk = self.track.data[start:end]
+            # `chunk` is a view on `self.track`: its data is only read (and its channels converted) when it is written
+            chunk = self.track.slice(start, end, self.to_outpath(i))
             # asert `chunk` has the same number of dimensions and same number of channels as `self.track`
-            assert_nchannels = chunk.shape[1] == self.track.data.shape[1] \
+            assert_nchannels = chunk.data.shape[1] == self.track.data.shape[1] \
                 if len(self.track.data.shape) > 1 \
                 else True  # if mono, then `len(track.shape)` = 1
-            assert len(chunk.shape) == len(self.track.data.shape) \
+            assert len(chunk.data.shape) == len(self.track.data.shape) \
                 and assert_nchannels
 
-            self.chunks.append(Track(
-                rate=self.track.rate,
-                data=chunk,
-                trackpath=self.to_outpath(i)
-            ))
+            self.chunks.append(chunk)
 
         return self
 
-    def write_chunks(self):
+    def has_equal_lengths(self) -> bool:
+        """check that all chunks in `self.chunk_pos` have the same length"""
+        lengths = self.chunk_pos[:, 1] - self.chunk_pos[:, 0]
+        return self.nchunks > 0 and bool(np.all(lengths == lengths[0]))
+
+    def make_batch(self):
+        """
+        batch version of `make_chunks`, for chunks that all have the same length, without a python loop:
+        populate `self.batch` with a view on `self.track.data` of shape `(nwindows, length)` (mono)
+        or `(nwindows, length, nchannels)`, and `self.batch_index` with the window of each chunk in `self.batch`.
+        no data is copied: each chunk is a view on `self.track.data`.
+
+        - if chunks are consecutive (`self.split_all`), `self.batch` is a reshaped view on `self.track.data`, with one window per chunk
+        - otherwise, `self.batch` is a strided view of all windows of `length` frames in `self.track.data`
+
+        NOTE: like in `make_chunks`, channel conversion is deferred until the chunks are written
         """
-        write self.chunks to outpath folder
+        data = self.track.data
+        starts = self.chunk_pos[:, 0]
+        length = int(self.chunk_pos[0, 1] - self.chunk_pos[0, 0])
+        if self.split_all and np.array_equal(starts, np.arange(self.nchunks) * length):
+            self.batch = data[:self.nchunks*length].reshape((self.nchunks, length, *data.shape[1:]))
+            self.batch_index = np.arange(self.nchunks)
+        else:
+            # `windows[i]` is the window of `length` frames starting at frame `i`. the window axis is appended last
+            windows = sliding_window_view(data, length, axis=0)
+            if data.ndim > 1:
+                windows = np.moveaxis(windows, -1, 1)
+            self.batch = windows
+            self.batch_index = starts
+        return self
+
+    def batch_to_chunks(self) -> Iterable[Track]:
+        """generate the chunks in `self.batch` as Tracks, one at a time"""
+        if self.batch is None or self.batch_index is None:
+            raise ValueError("expected a batch of chunks, got 'None'. run `Split.make_batch` first")
+        for i, window in enumerate(self.batch_index):
+            track = Track(self.track.rate, self.batch[window], self.to_outpath(i), self.track.policy, self.track.native_dtype)
+            yield track.set_nchannels(self.nchannels, lazy=True)  # pyright: ignore
+
+    def write_batch(self):
+        """
+        write the chunks in `self.batch` to outpath folder (see `Split.write_chunks`)
+        """
+        return self.write_chunks(self.batch_to_chunks())
+
+    def write_chunks(self, chunks: Iterable[Track]|None = None):
         """
-        for chunk in self.chunks:
-            chunk.write()
\ No newline at end of file
+        write self.chunks to outpath folder.
+
+        chunks are written concurrently by `self.nworkers` threads. the number of chunks being written at once
+        is bounded, so that only a limited number of chunks are loaded in memory at the same time.
+        a chunk that fails to be written does not stop the others: errors are printed and stored in `self.write_errors`.
+
+        :param chunks: the chunks to write. if None, `self.chunks`
+        """
+        chunks = self.chunks if chunks is None else chunks
+        self.write_errors = []
+        for chunk, _, error in thread_map_bounded(lambda c: c.write(), chunks, self.nworkers):
+            if error is not None:
+                print(f"error writing chunk '{chunk.trackpath}': {getattr(error, 'message', repr(error))}")
+                self.write_errors.append((chunk.trackpath, error))  # pyright: ignore
+        if len(self.write_errors):
+            print(f"failed to write {len(self.write_errors)}/{self.nchunks} chunks")
+        return self
+
+
+def split_one(trackpath: Path, seed: np.random.SeedSequence, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    split a single track into the existing directory `kwargs["outpath"]` and return a summary of the split.
+    defined at module level so that it can be run in a worker process.
+    """
+    t0 = time.perf_counter()
+    split = Split(trackpath=str(trackpath), make_outpath=False, seed=seed, **kwargs).pipeline()
+    return {
+        "trackpath": str(trackpath),
+        "nchunks": split.nchunks,
+        "write_errors": [ (str(fp), repr(e)) for fp, e in split.write_errors ],
+        "time": time.perf_counter() - t0
+    }
+
+
+def split_many(
+    trackpath: str,
+    outpath: str,
+    overwrite: bool = False,
+    nprocesses: int = 1,
+    seed: int|None = None,
+    **kwargs
+) -> List[Dict[str, Any]]:
+    """
+    split several tracks into chunks, in parallel.
+
+    all chunks are written to the same directory `outpath`, with the same naming as `Split.to_outpath`.
+    tracks are split by a pool of `nprocesses` worker processes, and a summary of all splits is printed at the end.
+
+    :param trackpath: path to a track, a directory of tracks or a glob pattern (see `expand_trackpaths`)
+    :param outpath: path to the output directory
+    :param overwrite: overwrite the contents of `outpath`
+    :param nprocesses: number of worker processes
+    :param seed: seed from which an independent seed is derived for each track (see `spawn_seeds`):
+        the output does not depend on `nprocesses`
+    :param kwargs: other parameters passed to `Split`
+    :returns: a summary of each split, in the same order as the tracks
+    """
+    trackpaths = expand_trackpaths(trackpath)
+    if not len(trackpaths):
+        raise ValueError(f"no sound file found at '{trackpath}'")
+    # chunks are named after their input track: 2 tracks with the same name would overwrite each other's chunks
+    names = [ re.sub(r"\.[^\.]+$", "", fp.name) for fp in trackpaths ]
+    duplicates = sorted(set( n for n in names if names.count(n) > 1 ))
+    if len(duplicates):
+        raise ValueError(f"several input tracks have the same name, their chunks would overwrite each other: {duplicates}")
+    outpath = make_dir(outpath, overwrite)  # pyright: ignore
+    kwargs = { **kwargs, "outpath": str(outpath) }
+    seeds = spawn_seeds(seed, len(trackpaths))
+
+    t0 = time.perf_counter()
+
+    def header(summaries: List[Dict[str, Any]]) -> str:
+        nchunks = sum( s.get("nchunks", 0) for s in summaries )
+        nwrite_errors = sum( len(s.get("write_errors", [])) for s in summaries )
+        return (
+            f"split {len(trackpaths) - len([ s for s in summaries if 'error' in s ])}/{len(trackpaths)} tracks "
+            f"into {nchunks - nwrite_errors} chunks in '{outpath}' ({time.perf_counter() - t0:.2f}s)"
+        )
+
+    def describe(s: Dict[str, Any]) -> str|None:
+        if "error" in s:
+            return f"- failed to split '{s['trackpath']}': {s['error']}"
+        if len(s["write_errors"]):
+            return f"- failed to write {len(s['write_errors'])} chunks of '{s['trackpath']}'"
+        return None
+
+    return process_map_summaries(
+        split_one,
+        [ (fp, fp_seed, kwargs) for fp, fp_seed in zip(trackpaths, seeds) ],
+        nprocesses,
+        on_error=lambda a: { "trackpath": str(a[0]) },
+        header=header,
+        describe=describe
+    )
@@ -1,9 +1,36 @@
+import os
 import unittest
+import tempfile
+from pathlib import Path
 
-from src.envelope import Envelope
-from src.splice import Splice
+import numpy as np
+
+from src.envelope import Envelope, random_breakpoints, interp_ragged
+from src.splice import Splice, pan_gains, fold_pattern, overlay_pattern, splice_variants
 from src.split import Split
-from src.track import Track
+from src.track import Track, TrackList
+from src.corpus import ChunkBank, CorpusCache
+from src.plan import SplicePlan
+from src.constants import PAN_CONSTANT_POWER, FORMAT_NATIVE, RESAMPLE_FFT
+from src.utils.utils import convert_format
+
+
+def write_noise_tracks(
+    dp: Path,
+    n: int,
+    nchannels: int,
+    rate: int = 8000,
+    seed: int = 0,
+    dtype: type = np.int16,
+    prefix: str = ""
+) -> Path:
+    """write `n` tracks of white noise at half of full scale, of random lengths (0.05s to 0.2s), in directory `dp`"""
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        shape = (int(rng.integers(rate // 20, rate // 5)), nchannels)
+        data = convert_format(rng.uniform(-0.5, 0.5, shape), np.float64, dtype)
+        Track(rate, data if nchannels > 1 else data[:, 0], dp.joinpath(f"{prefix}{i}.wav")).write()
+    return dp
 
 class TestEnvelope(unittest.TestCase):
     def setUp(self):
@@ -16,12 +43,330 @@ class TestEnvelope(unittest.TestCase):
         print("HELLOOOOOOOOO test_xxx")
 
 
+class TestInterpRagged(unittest.TestCase):
+    def check(self, breakpoints: np.ndarray, lengths: np.ndarray):
+        multipliers = interp_ragged(breakpoints, lengths)
+        self.assertEqual(multipliers.shape, (lengths.sum(),))
+        offset = 0
+        for (times, volumes), n in zip(breakpoints, lengths.tolist()):
+            np.testing.assert_array_equal(multipliers[offset:offset+n], np.interp(np.linspace(0, 1, n), times, volumes))
+            offset += n
+
+    def test_random(self):
+        """random envelopes over tracks of 0, 1, 2, small and large numbers of frames"""
+        rng = np.random.default_rng(0)
+        for lengths in [ [0], [1], [2], [0, 1, 2, 3, 5, 7], rng.integers(0, 50, 200), [ 44100, 3, 0, 100003 ] ]:
+            lengths = np.asarray(lengths)
+            self.check(random_breakpoints(len(lengths), rng), lengths)
+
+    def test_degenerate(self):
+        """breakpoints at the start or the end of the track, and phases of length 0"""
+        rng = np.random.default_rng(1)
+        times = np.array([
+            [ 0., 0., 0. ],      # a_t == d_t == s_t == 0
+            [ 0., .5, .8 ],      # a_t == 0
+            [ .2, .2, .8 ],      # d_t == a_t
+            [ .2, .5, .5 ],      # s_t == d_t
+            [ .2, .5, 1. ],      # s_t == 1
+            [ 1., 1., 1. ],      # a_t == d_t == s_t == 1
+            [ .5, .5, .5 ],      # all phases at the middle of the track
+            [ .25, .5, .75 ],    # breakpoints on frames when the number of frames is 4k+1
+        ])
+        for n in [ 0, 1, 2, 3, 5, 9, 101, 1000 ]:
+            breakpoints = random_breakpoints(len(times), rng)
+            breakpoints[:, 0, 1:4] = times
+            self.check(breakpoints, np.full(len(times), n))
+
+    def test_breakpoints_on_frames(self):
+        """envelopes that jump exactly on a frame, or one float before or after it: the frame is on the same side as with `np.interp`"""
+        for n in range(0, 60):
+            frames = np.linspace(0, 1, n)
+            times = np.concatenate([ frames, np.nextafter(frames, 0.), np.nextafter(frames, 1.), np.arange(1, n) / max(n - 1, 1) ])
+            breakpoints = np.zeros((len(times), 2, 5))
+            breakpoints[:, 0, 1:4] = np.clip(times, 0., 1.)[:, np.newaxis]  # attack, decay and sustain at the same time: a jump from 1 to .5
+            breakpoints[:, 0, 4] = 1.
+            breakpoints[:, 1, 1], breakpoints[:, 1, 2:4] = 1., .5
+            self.check(breakpoints, np.full(len(times), n))
+
+
+class TestSpliceStereoBank(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        self.tracksdir = root.joinpath("tracks")
+        self.bankdir = root.joinpath("bank")
+        self.tracksdir.mkdir()
+        self.bankdir.mkdir()
+        write_noise_tracks(self.tracksdir, 8, nchannels=2)
+        ChunkBank.build(TrackList.read_from_dir(self.tracksdir), self.bankdir)
+        self.outpath = root.joinpath("out.wav")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def splice(self, trackspath: Path, envelope: str|None) -> Splice:
+        return Splice(trackspath, self.outpath, length=1., nimpulses=20, envelope=envelope, seed=0, block=0.1)
+
+    def test_render(self):
+        """a stereo ChunkBank is converted to mono when chunks are read: it gives the same output as its source files"""
+        self.assertEqual(ChunkBank.read(self.bankdir).nchannels, 2)
+        for envelope in [ None, "random" ]:
+            expected = self.splice(self.tracksdir, envelope).render()
+            np.testing.assert_allclose(self.splice(self.bankdir, envelope).render(), expected, rtol=1e-5, atol=1e-2)
+
+    def test_render_blocks(self):
+        for envelope in [ None, "random" ]:
+            splice = self.splice(self.bankdir, envelope)
+            plan = splice.get_plan()
+            blocks = np.concatenate([ b.copy() for b in splice.render_blocks(splice.block_size, plan) ])  # pyright: ignore
+            np.testing.assert_allclose(blocks, splice.render(plan), rtol=1e-5, atol=1e-2)
+
+
+class TestSplice(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.tracksdir = self.root.joinpath("tracks")
+        self.tracksdir.mkdir()
+        write_noise_tracks(self.tracksdir, 8, nchannels=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def splice(self, **kwargs) -> Splice:
+        kwargs = { "length": 1., "nimpulses": 20, "envelope": "random", "seed": 0, **kwargs }
+        return Splice(self.tracksdir, self.root.joinpath("out.wav"), overwrite=True, **kwargs)
+
+    def test_render_blocks(self):
+        """rendering block by block gives the same output track as rendering it at once"""
+        for nchannels in [ 1, 2 ]:
+            splice = self.splice(nchannels=nchannels)
+            plan = splice.get_plan()
+            expected = splice.render(plan)
+            for block_size in [ 1000, 3333, plan.length ]:
+                blocks = np.concatenate([ b.copy() for b in splice.render_blocks(block_size, plan) ])
+                np.testing.assert_allclose(blocks, expected, rtol=1e-5, atol=1e-2)
+
+    def test_plan_roundtrip(self):
+        """a saved plan is rendered again into the same output track, whatever the seed"""
+        splice = self.splice()
+        plan = splice.make_plan()
+        fp = self.root.joinpath("plan.npz")
+        plan.save(fp)
+        loaded = SplicePlan.load(fp)
+        np.testing.assert_array_equal(loaded.timeline, plan.timeline)
+        self.assertEqual(loaded.trackpaths, plan.trackpaths)
+        np.testing.assert_array_equal(self.splice(seed=1, plan=fp).render(), splice.render(plan))
+
+    def test_plan_roundtrip_mixed_dtypes(self):
+        """a plan that only plays the int16 chunks of a mixed int16/float32 corpus keeps the scale of the whole corpus"""
+        write_noise_tracks(self.tracksdir, 1, nchannels=1, seed=1, dtype=np.float32, prefix="float_")
+        splice = self.splice()
+        self.assertEqual(splice.dtype, np.float32)
+        plan = splice.make_plan()
+        is_float = np.array([ Path(fp).name.startswith("float_") for fp in plan.trackpaths ])
+        plan.timeline["chunk"] = np.flatnonzero(~is_float)[plan.timeline["chunk"] % (~is_float).sum()]
+        fp = self.root.joinpath("plan.npz")
+        plan.save(fp)
+        expected = splice.render(plan)
+        self.assertLess(np.abs(expected).max(), 20.)  # in the float32 scale (-1..1 per chunk), not the int16 scale
+        np.testing.assert_allclose(self.splice(seed=1, plan=fp).render(), expected, rtol=1e-5, atol=1e-6)
+
+    def test_variant_seed(self):
+        """a variant rendered by `splice_variants` is rendered again on its own from its seed"""
+        outpath = self.root.joinpath("variant.wav")
+        summaries = splice_variants(self.tracksdir, outpath, nvariants=2, nprocesses=1, seed=3, length=1., nimpulses=20, envelope="random")
+        for summary in summaries:
+            again = self.root.joinpath("again.wav")
+            Splice(self.tracksdir, again, length=1., nimpulses=20, envelope="random", seed=summary["seed"], overwrite=True).pipeline()
+            np.testing.assert_array_equal(Track.read(again).data, Track.read(summary["outpath"]).data)
+
+    def test_overlay_pattern(self):
+        """the folded pattern is the same as adding the pattern at each repetition"""
+        rng = np.random.default_rng(0)
+        for shape, repeat in [ ((50,), 20), ((50,), 50), ((30,), 70), ((50, 2), 15) ]:
+            pattern = rng.uniform(-1, 1, shape)
+            length = 400
+            expected = np.zeros((length, *shape[1:]))
+            for start in range(0, length, repeat):
+                end = min(start + shape[0], length)
+                expected[start:end] += pattern[:end-start]
+            folded = fold_pattern(pattern, repeat)
+            np.testing.assert_allclose(overlay_pattern(np.zeros_like(expected), folded), expected)
+            # by blocks, as in `Splice.render_blocks`
+            for block_size in [ 7, 64, 399 ]:
+                blocks = np.concatenate([
+                    overlay_pattern(np.zeros_like(expected[start:start+block_size]), folded, start)
+                    for start in range(0, length, block_size)
+                ])
+                np.testing.assert_allclose(blocks, expected)
+
+    def test_pan_gains(self):
+        """constant-power panning keeps the sum of the squared gains at 1, from left to right"""
+        positions = np.linspace(-1, 1, 101)
+        gains = pan_gains(positions, PAN_CONSTANT_POWER, np.float64)
+        np.testing.assert_allclose((gains ** 2).sum(axis=1), 1.)
+        np.testing.assert_allclose(gains[0], [1., 0.], atol=1e-12)
+        np.testing.assert_allclose(gains[-1], [0., 1.], atol=1e-12)
+        np.testing.assert_allclose(gains[50], [np.sqrt(.5), np.sqrt(.5)])
+
+
+class TestSplit(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        rng = np.random.default_rng(0)
+        self.rate = 8000
+        # 800 frames: 10 consecutive chunks of 0.01s (80 frames) fill the whole track
+        self.trackpaths = {}
+        for nchannels in [ 1, 2 ]:
+            data = convert_format(rng.uniform(-0.5, 0.5, (800, nchannels)), np.float64, np.int16)
+            fp = self.root.joinpath(f"track{nchannels}.wav")
+            Track(self.rate, data if nchannels > 1 else data[:, 0], fp).write()
+            self.trackpaths[nchannels] = fp
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def split(self, nchannels_in: int, nchannels: int, **kwargs) -> Split:
+        kwargs = { "length": .01, "seed": 0, **kwargs }
+        split = Split(str(self.trackpaths[nchannels_in]), str(self.root.joinpath("out")), nchannels=nchannels, overwrite=True, **kwargs)
+        return split.make_chunk_pos()
+
+    def check_batch(self, split: Split):
+        """the chunks of `Split.make_batch` are the chunks of `Split.make_chunks`, and the frames of the converted track"""
+        self.assertTrue(split.has_equal_lengths())
+        expected = Track.read(split.track.trackpath).set_nchannels(split.nchannels).data  # pyright: ignore
+        chunks = split.make_chunks().chunks
+        batch = list(split.make_batch().batch_to_chunks())
+        self.assertEqual(len(batch), split.nchunks)
+        self.assertEqual(len(chunks), split.nchunks)
+        for (start, end), chunk, batch_chunk in zip(split.chunk_pos, chunks, batch):
+            self.assertEqual(batch_chunk.trackpath, chunk.trackpath)
+            self.assertEqual(batch_chunk.nchannels, split.nchannels)
+            np.testing.assert_array_equal(batch_chunk.get_data(), chunk.get_data())
+            np.testing.assert_array_equal(batch_chunk.get_data(), expected[start:end])
+
+    def test_split_all(self):
+        """consecutive chunks cover the whole track, up to its last frame"""
+        for nchannels_in in [ 1, 2 ]:
+            for nchannels in [ 1, 2 ]:
+                split = self.split(nchannels_in, nchannels)
+                self.assertTrue(split.split_all)
+                # chunk ends are exclusive: the last chunk ends at `nframes`, and the chunks are not rescaled
+                expected = np.arange(0, 801, 80)
+                np.testing.assert_array_equal(split.chunk_pos, np.stack([ expected[:-1], expected[1:] ], axis=1))
+                self.check_batch(split)
+
+    def test_random_starts(self):
+        """chunks at random positions stay inside the track, with the same length"""
+        for nchannels_in in [ 1, 2 ]:
+            for nchannels in [ 1, 2 ]:
+                for seed in range(5):
+                    split = self.split(nchannels_in, nchannels, nchunks=25, seed=seed)
+                    self.assertFalse(split.split_all)
+                    self.assertGreaterEqual(split.chunk_pos.min(), 0)
+                    self.assertLessEqual(split.chunk_pos[:, 1].max(), split.track.nframes)
+                    self.check_batch(split)
+
+
+class TestCorpusCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.tracksdir = self.root.joinpath("tracks")
+        self.tracksdir.mkdir()
+        write_noise_tracks(self.tracksdir, 3, nchannels=2)
+        self.cache = CorpusCache(self.root.joinpath("cache"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def entries(self) -> set:
+        return set( fp.name for fp in self.cache.cache_dir.iterdir() )
+
+    def test_invalidation(self):
+        """a modified source file only replaces its stale entry; the entries with other settings are kept"""
+        settings = [ { "nchannels": 1 }, { "nchannels": 2 }, { "nchannels": 1, "method": RESAMPLE_FFT } ]
+        for kwargs in settings:
+            self.cache.read_dir(self.tracksdir, **kwargs)
+        before = self.entries()
+        self.assertEqual(len(before), 3 * len(settings) * 2)  # one .npy and one .json file per entry
+
+        # modify a source file: new contents, and a modification time that is guaranteed to change
+        fp = self.tracksdir.joinpath("1.wav")
+        write_noise_tracks(self.tracksdir, 1, nchannels=2, seed=1, prefix="new")
+        self.tracksdir.joinpath("new0.wav").replace(fp)
+        stat = fp.stat()
+        os.utime(fp, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        tracks = self.cache.read_dir(self.tracksdir, nchannels=1)
+        after = self.entries()
+        stale, fresh = before - after, after - before
+        path_id = self.cache.path_id(fp)
+        # only the mono, polyphase entry of the modified file is replaced
+        self.assertEqual(len(stale), 2)
+        self.assertEqual(len(fresh), 2)
+        self.assertTrue(all( name.startswith(path_id) for name in stale | fresh ))
+        self.assertEqual(set( name.split("_")[1] for name in stale ), set( name.split("_")[1] for name in fresh ))
+        self.assertEqual(len(after), len(before))
+        # the new entry holds the new contents
+        track = tracks.get(tracks.trackpaths.index(str(fp)))
+        np.testing.assert_array_equal(track.get_data(), Track.read(fp).to_mono().data)
+        # and is read from the cache the next time
+        self.assertIsInstance(self.cache.read_dir(self.tracksdir, nchannels=1).get(0).data, np.memmap)
+
+
+class TestDtypePolicy(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        write_noise_tracks(self.root, 1, nchannels=2)
+        self.trackpath = self.root.joinpath("0.wav")
+        self.data = Track.read(self.trackpath).data
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def split(self, nchannels: int, format_: str) -> np.ndarray:
+        """split the int16 track in a single chunk, and return the data of the written chunk"""
+        outpath = self.root.joinpath("out")
+        Split(str(self.trackpath), str(outpath), length=len(self.data) / 8000, nchannels=nchannels, format_=format_, overwrite=True, seed=0).pipeline()
+        chunks = list(outpath.iterdir())
+        self.assertEqual(len(chunks), 1)
+        return Track.read(chunks[0]).data
+
+    def test_native(self):
+        """int16 input is written as int16 with the native format, also after a channel conversion"""
+        self.assertEqual(self.data.dtype, np.int16)
+        out = self.split(2, FORMAT_NATIVE)
+        self.assertEqual(out.dtype, np.int16)
+        np.testing.assert_array_equal(out, self.data)
+        out = self.split(1, FORMAT_NATIVE)
+        self.assertEqual(out.dtype, np.int16)
+        np.testing.assert_allclose(out, self.data.mean(axis=1), atol=1)
+
+    def test_float32(self):
+        """int16 input is rescaled to -1..1 with the float32 format"""
+        for nchannels, expected in [ (2, self.data), (1, self.data.mean(axis=1)) ]:
+            out = self.split(nchannels, "float32")
+            self.assertEqual(out.dtype, np.float32)
+            self.assertLessEqual(np.abs(out).max(), 1.)
+            np.testing.assert_allclose(out, expected / 32768., rtol=1e-6, atol=1e-7)
+
+
 def runner() -> None:
     loader = unittest.TestLoader()
     suite = unittest.TestSuite()
     suite.addTests([
         # add other tests here
-        loader.loadTestsFromTestCase(TestEnvelope)
+        loader.loadTestsFromTestCase(TestEnvelope),
+        loader.loadTestsFromTestCase(TestInterpRagged),
+        loader.loadTestsFromTestCase(TestSpliceStereoBank),
+        loader.loadTestsFromTestCase(TestSplice),
+        loader.loadTestsFromTestCase(TestSplit),
+        loader.loadTestsFromTestCase(TestCorpusCache),
+        loader.loadTestsFromTestCase(TestDtypePolicy),
     ])
 
     runner = unittest.TextTestRunner()
@@ -1,13 +1,46 @@
-from typing import Tuple, List
+from typing import List, Literal
 from pathlib import Path
-import random
+from math import gcd
+import os
 
 import numpy as np
-from scipy.signal import resample
 
 from src.utils.io_op import read_wav, write_wav, read_wav_from_dir
-from src.utils.utils import frame_to_seconds, seconds_to_frame, get_random_item
-from src.utils.validate import validate_type, validate_float_isinrange, validate_comparison
+from src.utils.utils import frame_to_seconds, seconds_to_frame, get_random_item, convert_format, make_rng, Seed
+from src.utils.validate import validate_type, validate_float_isinrange, validate_comparison, validate_isinlist, should_validate
+from src.utils.parallel import thread_map_bounded
+from src.utils.profile import stage, RESAMPLE, CHANNEL_CONVERSION
+
+from src.constants import RESAMPLE_POLY, RESAMPLE_FFT, FORMAT_NATIVE, PRECISIONS, FORMATS
+
+
+class DtypePolicy:
+    def __init__(self, precision: str = "float32", format_: str = FORMAT_NATIVE):
+        """
+        define the dtypes used to process and write tracks.
+
+        tracks keep their native dtype (the dtype of the file they were read from) as long as no computation
+        is needed. when a computation is needed (channel conversion, resampling, envelopes, mixing...), data is
+        converted to `precision`. data is converted to the output format only once, when it is written.
+        NOTE: processed data keeps the scale of the native dtype (int16 data converted to float32 stays in range -32768..32767)
+
+        :param precision: float dtype used for processing: "float32" or "float64"
+        :param format_: dtype of the written files: "native" (the native dtype of the track) or a dtype supported by wav files
+        """
+        validate_isinlist(precision, PRECISIONS)
+        validate_isinlist(format_, FORMATS)
+        self.precision = np.dtype(precision)
+        self.format = None if format_ == FORMAT_NATIVE else np.dtype(format_)
+
+    def to_float(self, data: np.ndarray) -> np.ndarray:
+        """convert `data` to the processing dtype if it is not a float array of that dtype"""
+        return data if data.dtype == self.precision else data.astype(self.precision)
+
+    def to_output(self, data: np.ndarray, native_dtype: np.dtype) -> np.ndarray:
+        """convert `data`, in the scale of `native_dtype`, to the output format"""
+        return convert_format(data, native_dtype, native_dtype if self.format is None else self.format)
+
+DEFAULT_POLICY = DtypePolicy()
 
 def get_nchannels(data:np.ndarray) -> int:
         if len(data.shape) == 1:
@@ -18,24 +51,79 @@ def get_nchannels(data:np.ndarray) -> int:
             raise ValueError(f"unexpected shape of data: expected (x,) or (x,y), got {data.shape}")
 
 
+def to_nchannels(data:np.ndarray, nchannels:int, dtype:np.dtype|type=np.float32) -> np.ndarray:
+    """
+    convert `data` to `nchannels` channels (1=mono, 2=stereo).
+
+    the output is allocated once, and computed by writing directly into it: no intermediate arrays are created.
+    if no conversion is needed, `data` is returned as is.
+
+    :param dtype: float dtype of the converted data. unused if no conversion is needed
+    """
+    nchannels_in = get_nchannels(data)
+    if nchannels_in == nchannels:
+        return data
+    with stage(CHANNEL_CONVERSION):
+        if nchannels == 1:
+            # average of all channels. summing the channels one by one is much faster than a reduction along the short axis 1 (`np.mean(data, axis=1)`)
+            out = np.empty(data.shape[0], dtype=dtype)
+            np.add(data[:, 0], data[:, 1], out=out, dtype=dtype)
+            for c in range(2, nchannels_in):
+                np.add(out, data[:, c], out=out, dtype=dtype)
+            out *= np.asarray(1 / nchannels_in, dtype=dtype)
+            return out
+        elif nchannels == 2 and nchannels_in == 1:
+            # convert np.ndarray of shape (x,) into np.ndarray of shape (x, 2): [ [l1,r1],[l2,r2], ... ]
+            # the halved data is written directly in the left channel of `out`, then copied to the right channel
+            out = np.empty((data.shape[0], 2), dtype=dtype)
+            np.multiply(data, np.asarray(0.5, dtype=dtype), out=out[:, 0], dtype=dtype)
+            out[:, 1] = out[:, 0]
+            return out
+        else:
+            raise NotImplementedError(f"conversion from '{nchannels_in}' to '{nchannels}' channels not implemented")
+
+
 class Track:
-    def __init__(self, rate: int, data: np.ndarray, trackpath:Path|None = None):
+    def __init__(
+        self,
+        rate: int,
+        data: np.ndarray,
+        trackpath:Path|None = None,
+        policy: DtypePolicy = DEFAULT_POLICY,
+        native_dtype: np.dtype|None = None
+    ):
         """
         :param rate: the sampling rate of the track
         :param data: 1 or 2d np.ndarray containing the track
         :param trackpath: path to the track file (optional; a trackpath that does not exist on the filesystem may be provided, for example to use `Track` as an interface to write a new track to file)
+        :param policy: dtypes used to process and write the track (see `DtypePolicy`)
+        :param native_dtype: dtype of the file the track was read from, which defines the scale of `data`. defaults to `data.dtype`
+
+        NOTE: a Track can be lazy: `data` can be memory-mapped (see `Track.read`) and channel conversion
+        can be deferred (see `Track.to_mono` and `Track.to_stereo`). in that case, `self.data` holds the raw
+        data and `self.nchannels` the number of channels after conversion. use `Track.get_data`
+        and `Track.get_frames` to access the converted data.
         """
         self.nchannels = get_nchannels(data)
         self.rate = rate
         self.nframes = data.shape[0]  # number of frames in Track
         self.data = data
         self.trackpath = trackpath  # path to the track
+        self.convert_to: int|None = None  # deferred channel conversion
+        self.policy = policy
+        self.native_dtype = data.dtype if native_dtype is None else np.dtype(native_dtype)
 
     @classmethod
-    def read(cls, trackpath: str|Path) -> 'Track':
-        """read the file at `trackpath` into a `Track`"""
-        (rate, data), trackpath = read_wav(trackpath)
-        return Track(rate, data, trackpath)
+    def read(cls, trackpath: str|Path, mmap: bool = False, policy: DtypePolicy = DEFAULT_POLICY) -> 'Track':
+        """
+        read the file at `trackpath` into a `Track`
+
+        :param trackpath: path to the file
+        :param mmap: memory-map the file instead of loading it in RAM
+        :param policy: dtypes used to process and write the track (see `DtypePolicy`)
+        """
+        (rate, data), trackpath = read_wav(trackpath, mmap)
+        return Track(rate, data, trackpath, policy)
 
 
     def write(self):
@@ -44,40 +132,99 @@ class Track:
             raise ValueError(f"expected a path to write to, got '{self.trackpath}")
         if self.data is None:
             raise ValueError(f"expected data to write, got '{self.data}")
-        write_wav(self.trackpath, self.rate, self.data)
+        write_wav(self.trackpath, self.rate, self.policy.to_output(self.get_data(), self.native_dtype))
         return self
 
-    def to_mono(self):
-        if self.nchannels > 1:
-            self.data = np.mean(self.data, axis=1)
-            self.nchannels = 1
-        return self
+    def copy(self) -> 'Track':
+        """return a copy of `self` that does not share its data with `self`"""
+        # the deferred channel conversion already creates a new array
+        data = np.array(self.data) if self.convert_to is None else self.get_data()
+        return Track(self.rate, data, self.trackpath, self.policy, self.native_dtype)
+
+    def get_data(self) -> np.ndarray:
+        """return `self.data`, applying the deferred channel conversion if there is one"""
+        if self.convert_to is None:
+            return self.data
+        return to_nchannels(self.data, self.convert_to, self.policy.precision)
 
-    def to_stereo(self):
-        if self.nchannels == 2:
-            pass
-        elif self.nchannels == 1:
-            # convert np.ndarray of shape (x, 1) into np.ndarray of shape (x, 2): [ [l1,r1],[l2,r2], ... ]
-            self.data = self.data / 2
-            self.data = np.transpose(np.vstack((self.data, self.data)))
-            self.nchannels = 2
+    def get_frames(self, start:int, end:int) -> np.ndarray:
+        """
+        return the frames `start` (inclusive) to `end` (exclusive), applying the deferred channel conversion
+        if there is one. if `self.data` is memory-mapped, only those frames are read from disk.
+        """
+        frames = self.data[start:end]
+        if self.convert_to is None:
+            return frames
+        return to_nchannels(frames, self.convert_to, self.policy.precision)
+
+    def slice(self, start:int, end:int, trackpath:Path|None = None) -> 'Track':
+        """
+        return the frames `start` (inclusive) to `end` (exclusive) as a new Track.
+        no data is copied or converted: the new Track is a view on `self.data` with the same deferred channel conversion.
+        """
+        track = Track(self.rate, self.data[start:end], trackpath, self.policy, self.native_dtype)
+        track.convert_to = self.convert_to
+        track.nchannels = self.nchannels
+        return track
+
+    def set_nchannels(self, nchannels:int, lazy:bool=False) -> 'Track':
+        """
+        convert `self` to `nchannels` channels.
+
+        :param nchannels: 1 (mono) or 2 (stereo)
+        :param lazy: defer the conversion: it will only be applied to the frames that are actually read (see `Track.get_frames`)
+        """
+        if lazy:
+            self.convert_to = None if get_nchannels(self.data) == nchannels else nchannels
         else:
-            raise NotImplementedError(f"'to_stereo' conversion not implemented for number of channels: '{self.nchannels}'")
+            self.data = to_nchannels(self.data, nchannels, self.policy.precision)
+            self.convert_to = None
+        self.nchannels = nchannels
         return self
 
-    def resample(self, new_rate:int) -> 'Track':
-        """resample to a new rate"""
+    def to_mono(self, lazy:bool=False):
+        return self.set_nchannels(1, lazy)
+
+    def to_stereo(self, lazy:bool=False):
+        if get_nchannels(self.data) > 2:
+            raise NotImplementedError(f"'to_stereo' conversion not implemented for number of channels: '{get_nchannels(self.data)}'")
+        return self.set_nchannels(2, lazy)
+
+    def resample(self, new_rate:int, method:Literal["polyphase", "fft"]=RESAMPLE_POLY, validate_off:bool=False) -> 'Track':
+        """
+        resample to a new rate
+
+        :param new_rate: the new sampling rate
+        :param method: resampling backend.
+            - "polyphase": polyphase filtering with the rational ratio `new_rate/self.rate` (44100 -> 48000 = *160/147).
+              fast and memory-efficient, especially on long tracks.
+            - "fft": FFT-based resampling over the whole track. slow on long or prime-length tracks.
+        :param validate_off: disable validation (see `should_validate`)
+        """
+        if should_validate(validate_off):
+            validate_isinlist(method, [RESAMPLE_POLY, RESAMPLE_FFT])
         if new_rate != self.rate:
-            # scikit's `resample` resamples to a specific number of frames, not to a sampling rate
-            nframes = seconds_to_frame(
-                frame_to_seconds(self.nframes, self.rate),
-                new_rate
-            )
-            resampled: np.ndarray = resample(self.data, nframes)  # pyright: ignore
-            assert resampled.shape[0] == nframes, f"wrong number of resampled frames: expected {nframes}, got {resampled.shape[0]}"
-            self.data = resampled
-            self.rate = new_rate
-            self.nframes = nframes
+            # scipy.signal is slow to import: it is only imported when a track needs resampling
+            from scipy.signal import resample, resample_poly
+            with stage(RESAMPLE):
+                nframes = seconds_to_frame(
+                    frame_to_seconds(self.nframes, self.rate),
+                    new_rate
+                )
+                data = self.policy.to_float(self.data)
+                if method == RESAMPLE_POLY:
+                    divisor = gcd(new_rate, self.rate)
+                    resampled: np.ndarray = resample_poly(data, new_rate // divisor, self.rate // divisor, axis=0)
+                    # `resample_poly` outputs `ceil(self.nframes * new_rate / self.rate)` frames: there can be 1 frame too many
+                    resampled = resampled[:nframes]
+                else:
+                    # scikit's `resample` resamples to a specific number of frames, not to a sampling rate
+                    resampled: np.ndarray = resample(data, nframes)  # pyright: ignore
+                resampled = self.policy.to_float(resampled)
+                assert resampled.shape[0] == nframes, f"wrong number of resampled frames: expected {nframes}, got {resampled.shape[0]}"
+                self.data = resampled
+                self.rate = new_rate
+                self.nframes = nframes
         return self
 
     def get_frame_index(self, pct:float, validate_off:bool=False) -> int:
@@ -85,29 +232,32 @@ class Track:
         return the frame number that corresponds to the position `pct`
 
         :param pct: percentage of track duration, in range 0..1 (0= 1st frame in the track, 1=last frame in the track)
-        :param validate_off: disable type validation
+        :param validate_off: disable validation (see `should_validate`)
         """
-        if not validate_off:
+        if should_validate(validate_off):
             validate_type(self.data, np.ndarray)
             validate_float_isinrange(pct, 0, 1, inclusive=True)
         return round(pct * self.data.shape[0])  # ex: 30000 frames in a track => get_frame_index(0.5) -> 15000
 
 
-    def get_range(self, pct_start:float, pct_end: float) -> np.ndarray:
+    def get_range(self, pct_start:float, pct_end: float, validate_off:bool=False) -> np.ndarray:
         """
         return a percentage of `self.data`.
 
         :param pct_start: selection start (inclusive) in a 0..1 range (0=start of track, 1=end of track)
         :param pct_end: selection end (exclusive) in a 0..1 range (0=start of track, 1=end of track)
+        :param validate_off: disable validation (see `should_validate`). for internal callers in hot loops,
+            whose inputs are valid by construction
         """
-        validate_type(self.data, np.ndarray)
-        for pct in (pct_start, pct_end):
-            validate_float_isinrange(pct, 0, 1, inclusive=True)
-        validate_comparison("lt", pct_start, pct_end)
+        if should_validate(validate_off):
+            validate_type(self.data, np.ndarray)
+            for pct in (pct_start, pct_end):
+                validate_float_isinrange(pct, 0, 1, inclusive=True)
+            validate_comparison("lt", pct_start, pct_end)
 
         frame_start = self.get_frame_index(pct_start, True)
         frame_end = self.get_frame_index(pct_end, True)
-        return self.data[frame_start:frame_end]
+        return self.get_frames(frame_start, frame_end)
 
     def fill(self) -> "Track":
         """
@@ -123,9 +273,34 @@ class TrackList:
 
     tracklist: List[Track] = []
     rate: int
+    dtype: np.dtype
+    policy: DtypePolicy
+    rng: np.random.Generator
 
-    def __init__(self, tracks: List[Track]):
+    def __init__(self, tracks: List[Track], policy: DtypePolicy = DEFAULT_POLICY, rng: Seed = None, dtype: np.dtype|str|None = None):
+        """
+        :param tracks: the tracks
+        :param policy: dtypes used to process and write the tracks (see `DtypePolicy`). applied to all tracks
+        :param rng: random generator or seed used to pick tracks (see `make_rng`)
+        :param dtype: native dtype of the TrackList. if None, the dtype to which the native dtypes of all tracks are promoted.
+            provide it when `tracks` are only a part of a corpus, so that they keep the scale of the whole corpus (see `SplicePlan.read_chunks`)
+        """
         self.tracklist = tracks
+        self.policy = policy
+        self.rng = make_rng(rng)
+        for t in tracks:
+            t.policy = policy
+        # native dtype of the input tracks, before any conversion
+        if dtype is not None:
+            self.dtype = np.dtype(dtype)
+        else:
+            self.dtype = np.result_type(*[ t.native_dtype for t in tracks ]) if len(tracks) else np.dtype(np.float64)
+        # tracks keep the scale of their native dtype (see `DtypePolicy`): tracks of other dtypes are rescaled
+        # to `self.dtype`, so that all tracks are mixed at the same scale
+        for t in tracks:
+            if t.native_dtype != self.dtype:
+                t.data = convert_format(t.data, t.native_dtype, self.dtype)
+                t.native_dtype = self.dtype
         self.resample()
 
     def get_best_rate(self):
@@ -134,14 +309,24 @@ class TrackList:
         else:
             raise ValueError("TrackList.tracklist is empty")
 
-    def resample(self) -> 'TrackList':
+    def resample(self, method:Literal["polyphase", "fft"]=RESAMPLE_POLY, nworkers:int|None=None) -> 'TrackList':
         """
-        resample all tracks in 'TrackList' to the highest rate among these tracks
+        resample all tracks in 'TrackList' to the highest rate among these tracks.
+        tracks are resampled concurrently by `nworkers` threads (defaults to the number of CPUs).
+
+        :param method: resampling backend (see `Track.resample`)
+        :param nworkers: number of threads
         """
+        validate_isinlist(method, [RESAMPLE_POLY, RESAMPLE_FFT])
         best_rate = self.get_best_rate()
-        self.tracklist = [
-            t.resample(best_rate) for t in self.tracklist
-        ]
+        nworkers = (os.cpu_count() or 1) if nworkers is None else nworkers
+        tracklist = []
+        # `method` is validated once for all tracks
+        for t, resampled, error in thread_map_bounded(lambda t: t.resample(best_rate, method, True), self.tracklist, nworkers):
+            if error is not None:
+                raise error
+            tracklist.append(resampled)
+        self.tracklist = tracklist
         self.rate = best_rate
         return self
 
@@ -149,16 +334,32 @@ class TrackList:
         self.tracklist = [ t.to_mono() for t in self.tracklist ]
         return self
 
+    def __len__(self) -> int:
+        return len(self.tracklist)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """number of frames of each track"""
+        return np.array([ t.nframes for t in self.tracklist ], dtype=np.int64)
+
+    @property
+    def trackpaths(self) -> List[str]:
+        """path to the source file of each track"""
+        return [ str(t.trackpath) for t in self.tracklist ]
+
+    def get(self, i: int) -> Track:
+        return self.tracklist[i]
+
     def get_one(self) -> Track:
-        return get_random_item(self.tracklist)
+        return get_random_item(self.tracklist, self.rng)
 
     @classmethod
-    def read_from_dir(cls, trackspath: str|Path) -> "TrackList":
+    def read_from_dir(cls, trackspath: str|Path, policy: DtypePolicy = DEFAULT_POLICY, rng: Seed = None) -> "TrackList":
         return TrackList([
             Track(rate, data, trackpath)
             for ((rate, data), trackpath)
             in read_wav_from_dir(trackspath)
-        ])
+        ], policy, rng)
 
 
 
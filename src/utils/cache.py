@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import Hashable, Callable
+import threading
+
+import numpy as np
+
+
+class ArrayLRUCache:
+
+    def __init__(self, max_entries: int|None = 128, max_bytes: int|None = None):
+        """
+        bounded least-recently-used cache of numpy arrays.
+
+        when the cache is full, the least recently used arrays are evicted.
+        cached arrays are set as read-only to avoid altering the cache by accident.
+
+        :param max_entries: maximum number of arrays in the cache (if None, no limit on the number of entries)
+        :param max_bytes: maximum size of the cache in bytes (if None, no limit on the size of the cache)
+        """
+        if max_entries is not None and max_entries < 0:
+            raise ValueError(f"invalid value for 'max_entries': expected a positive int or None, got '{max_entries}'")
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError(f"invalid value for 'max_bytes': expected a positive int or None, got '{max_bytes}'")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0  # current size of the cache
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable) -> np.ndarray|None:
+        """return the array stored at `key` and mark it as recently used, or None if `key` is not cached"""
+        with self._lock:
+            a = self._data.get(key)
+            if a is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return a
+
+    def put(self, key: Hashable, a: np.ndarray) -> np.ndarray:
+        """store `a` at `key`, evicting the least recently used arrays if needed"""
+        a.flags.writeable = False
+        # arrays that are too big for the cache are returned without being cached
+        if self.max_bytes is not None and a.nbytes > self.max_bytes:
+            return a
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key).nbytes
+            self._data[key] = a
+            self.nbytes += a.nbytes
+            self._evict()
+        return a
+
+    def get_or_make(self, key: Hashable, make: Callable[[], np.ndarray]) -> np.ndarray:
+        """return the array stored at `key`. if it is not cached, build it with `make()` and cache it"""
+        a = self.get(key)
+        if a is None:
+            a = self.put(key, make())
+        return a
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _evict(self) -> None:
+        while (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            _, a = self._data.popitem(last=False)
+            self.nbytes -= a.nbytes
@@ -1,16 +1,20 @@
 import os
+import glob
 import json
+import struct
 import shutil
 from pathlib import Path, PurePath
 from typing import Tuple, List, Dict
 
 import numpy as np
-from scipy.io import wavfile
 
 from .validate import validate_path_exists
+from .parallel import thread_map_bounded
+from .profile import stage, READ, WRITE
 
 
 CWD = Path(os.getcwd())
+WAV_MAX_SIZE = 2**32 - 1  # the sizes of a RIFF file and its chunks are stored as 32-bit unsigned ints
 
 def fp_to_abs(fp:Path|str) -> Path:
     """convert 'fp' to an absolute path"""
@@ -62,31 +66,221 @@ def make_dir(dir_: str|Path, overwrite:bool) -> Path:
     return dir_
 
 
-def read_wav(fp:Path|str) -> Tuple[Tuple[int, np.ndarray], Path]:
+def read_wav(fp:Path|str, mmap:bool=False) -> Tuple[Tuple[int, np.ndarray], Path]:
+    """
+    :param fp: path to the wav file
+    :param mmap: memory-map the data instead of loading it in RAM: only the slices
+        of data that are actually accessed will be read from disk.
+        if the file's format is not compatible with memory-mapping (24-bit PCM...), it is loaded in RAM.
+    """
+    # scipy.io is slow to import: it is only imported when a file is read or written
+    from scipy.io import wavfile
     fp = fp_to_abs_validate(fp)
-    return wavfile.read(fp), fp
+    with stage(READ):
+        if mmap:
+            try:
+                return wavfile.read(fp, mmap=True), fp
+            except ValueError as e:
+                if "mmap" not in str(e):
+                    raise e
+        return wavfile.read(fp), fp
 
 
 def write_wav(fp:Path|str, rate:int, data:np.ndarray) -> None:
-    return wavfile.write(fp, rate, data)
+    from scipy.io import wavfile
+    with stage(WRITE):
+        return wavfile.write(fp, rate, data)
+
+
+class WavStreamWriter:
+
+    def __init__(self, fp:Path|str, rate:int, nchannels:int, dtype:np.dtype|type, nframes:int|None = None):
+        """
+        write a wav file incrementally, block by block, instead of writing a whole array at once like `write_wav`.
+        the header is written with placeholder sizes when the file is opened and updated when it is closed.
+
+        >>> with WavStreamWriter(fp, rate, 2, np.int16) as writer:
+        ...     for block in blocks:
+        ...         writer.write(block)
+
+        NOTE: a wav file can't be larger than 4GiB (`WAV_MAX_SIZE`). a ValueError is raised before
+        that limit is crossed: when the file is opened if `nframes` is known, otherwise by `write`.
+
+        :param fp: path to the output file
+        :param rate: sampling rate
+        :param nchannels: number of channels
+        :param dtype: dtype of the samples. supported: uint8, int16, int32, int64 (PCM) and float32, float64 (IEEE float)
+        :param nframes: expected number of frames in the file, if it is known. used to check the size of the file before writing it
+        """
+        dtype = np.dtype(dtype)
+        if dtype.kind == "f" and dtype.itemsize in (4, 8):
+            self.format_tag = 0x0003  # IEEE float
+        elif (dtype.kind == "i" and dtype.itemsize in (2, 4, 8)) or dtype == np.uint8:
+            self.format_tag = 0x0001  # PCM
+        else:
+            raise ValueError(f"unsupported dtype for a wav file: '{dtype}'")
+        self.fp = fp_to_abs(fp)
+        self.rate = rate
+        self.nchannels = nchannels
+        self.dtype = dtype.newbyteorder("<")  # wav files are little-endian
+        self.nframes = 0
+        # largest number of frames such that the RIFF size (header + word-aligned data) fits in 32 bits
+        block_align = self.nchannels * self.dtype.itemsize
+        self.max_frames = (WAV_MAX_SIZE - 1 - self._header_size()) // block_align
+        if nframes is not None and nframes > self.max_frames:
+            raise ValueError(self._size_error(nframes))
+        self.fh = open(self.fp, mode="wb")
+        self._write_header()
+
+    def _header_size(self) -> int:
+        """size of the RIFF header, counted in the RIFF size: 'WAVE', the fmt chunk, the fact chunk and the data chunk header"""
+        fmt_size = 16 if self.format_tag == 0x0001 else 18
+        fact_size = 0 if self.format_tag == 0x0001 else 12
+        return 4 + (8 + fmt_size) + fact_size + 8
+
+    def _size_error(self, nframes: int) -> str:
+        return (f"the output track is too large for a wav file: {nframes} frames of {self.nchannels} channels in {self.dtype.name} "
+                f"take {nframes * self.nchannels * self.dtype.itemsize} bytes, but wav files are limited to {WAV_MAX_SIZE} bytes "
+                f"({self.max_frames} frames). use a shorter track or a smaller output format (file='{self.fp}')")
+
+    def _write_header(self) -> None:
+        block_align = self.nchannels * self.dtype.itemsize
+        data_size = self.nframes * block_align
+        fmt_chunk = struct.pack(
+            "<HHIIHH",
+            self.format_tag,
+            self.nchannels,
+            self.rate,
+            self.rate * block_align,
+            block_align,
+            self.dtype.itemsize * 8
+        )
+        if self.format_tag == 0x0003:
+            # non-PCM formats have an extension size and a 'fact' chunk
+            fmt_chunk += struct.pack("<H", 0)
+            fact_chunk = b"fact" + struct.pack("<II", 4, self.nframes * self.nchannels)
+        else:
+            fact_chunk = b""
+        self.fh.seek(0)
+        self.fh.write(b"RIFF" + struct.pack("<I", self._header_size() + data_size + data_size % 2) + b"WAVE")
+        self.fh.write(b"fmt " + struct.pack("<I", len(fmt_chunk)) + fmt_chunk)
+        self.fh.write(fact_chunk)
+        self.fh.write(b"data" + struct.pack("<I", data_size))
 
+    def write(self, data:np.ndarray) -> None:
+        """append `data` (of shape (x,) if mono, (x, nchannels) otherwise) to the file"""
+        nchannels = 1 if data.ndim == 1 else data.shape[1]
+        if nchannels != self.nchannels:
+            raise ValueError(f"expected data with {self.nchannels} channels, got {nchannels}")
+        if self.nframes + data.shape[0] > self.max_frames:
+            raise ValueError(self._size_error(self.nframes + data.shape[0]))
+        with stage(WRITE):
+            self.fh.write(np.ascontiguousarray(data, dtype=self.dtype).tobytes())
+        self.nframes += data.shape[0]
 
-def read_wav_from_dir(dp:str|Path) ->  List[Tuple[Tuple[int, np.ndarray], Path]]:
+    def close(self) -> None:
+        if self.fh.closed:
+            return
+        data_size = self.nframes * self.nchannels * self.dtype.itemsize
+        if data_size % 2:
+            self.fh.write(b"\x00")  # chunks are word-aligned
+        self._write_header()
+        self.fh.close()
+
+    def __enter__(self) -> "WavStreamWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def is_wav(fp:Path|str) -> bool:
     """
-    :returns: [ ((rate1, data1), fp1), ((rate2, data2), fp2), ... ]
+    check that `fp` is a wav file by reading its RIFF/WAVE header only, without decoding it
+    """
+    try:
+        with open(fp, mode="rb") as fh:
+            header = fh.read(12)
+    except OSError:
+        return False
+    return len(header) == 12 and header[:4] in (b"RIFF", b"RIFX", b"RF64") and header[8:12] == b"WAVE"
+
+
+def read_wav_rate(fp:Path|str) -> int:
+    """
+    read the sampling rate of a wav file from its header, without decoding it
+    """
+    with open(fp, mode="rb") as fh:
+        riff = fh.read(12)
+        if riff[:4] not in (b"RIFF", b"RIFX", b"RF64") or riff[8:12] != b"WAVE":
+            raise ValueError(f"not a wav file: '{fp}'")
+        endian = ">" if riff[:4] == b"RIFX" else "<"
+        while True:
+            chunk_header = fh.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"no 'fmt ' chunk found in wav file '{fp}'")
+            chunk_id, chunk_size = chunk_header[:4], struct.unpack(f"{endian}I", chunk_header[4:])[0]
+            if chunk_id == b"fmt ":
+                return struct.unpack(f"{endian}I", fh.read(8)[4:8])[0]
+            fh.seek(chunk_size + chunk_size % 2, 1)  # chunks are word-aligned
+
+
+def list_wav_dir(dp:str|Path) -> List[Path]:
+    """
+    list the wav files in directory `dp`, sorted by path. non-wav files are skipped by checking their header.
     """
     dp = fp_to_abs(dp)
     if not dp.is_dir():
         raise ValueError(f"'dp' should be a path to an existing directory (dp=`{dp}`)")
-    fp_list = [ fp.resolve() for fp in dp.iterdir() if fp.is_file() ]
-    tracklist = []
+    fp_list = sorted( fp.resolve() for fp in dp.iterdir() if fp.is_file() )
+    wav_list = []
     for fp in fp_list:
-        try:
-            tracklist.append(read_wav(fp))
-        except ValueError:
+        if is_wav(fp):
+            wav_list.append(fp)
+        else:
+            print(f"skipping non-sound file '{fp}'")
+    return wav_list
+
+
+def expand_trackpaths(trackpath:str|Path) -> List[Path]:
+    """
+    expand `trackpath` into a list of paths to sound files, sorted by path:
+    - if `trackpath` is a directory, all wav files in it
+    - if `trackpath` is a glob pattern (`*.wav`, `archive/**/*.wav`...), all wav files that match it
+    - otherwise, `trackpath` itself
+    """
+    if fp_to_abs(trackpath).is_dir():
+        return list_wav_dir(trackpath)
+    elif glob.has_magic(str(trackpath)):
+        fp_list = sorted( fp_to_abs(fp).resolve() for fp in glob.glob(str(trackpath), recursive=True) )
+        return [ fp for fp in fp_list if fp.is_file() and is_wav(fp) ]
+    return [ fp_to_abs_validate(trackpath) ]
+
+
+def read_wav_from_dir(dp:str|Path, nworkers:int|None=None) ->  List[Tuple[Tuple[int, np.ndarray], Path]]:
+    """
+    read all wav files in directory `dp`.
+
+    non-wav files are skipped by checking their header, without decoding them. the wav files are
+    then decoded concurrently by `nworkers` threads. files are returned sorted by path.
+
+    :param dp: path to the directory
+    :param nworkers: number of threads used to decode the files (defaults to the number of CPUs)
+    :returns: [ ((rate1, data1), fp1), ((rate2, data2), fp2), ... ]
+    """
+    nworkers = (os.cpu_count() or 1) if nworkers is None else nworkers
+    wav_list = list_wav_dir(dp)
+
+    tracklist = []
+    for fp, track, error in thread_map_bounded(read_wav, wav_list, nworkers):
+        if error is None:
+            tracklist.append(track)
+        elif isinstance(error, ValueError):
             print(f"skipping non-sound file '{fp}'")
+        else:
+            raise error
     if not len(tracklist):
-        raise ValueError(f"directory should contain at least one sound file (directory='{dp}', contents='{fp_list}')")
+        raise ValueError(f"directory should contain at least one sound file (directory='{dp}', sound files='{wav_list}')")
 
     return tracklist
 
@@ -94,6 +288,10 @@ def write_json(fp:Path|str, data:Dict|List) -> None:
     with open(fp, mode="w") as fh:
         json.dump(data, fh)
 
+def read_json(fp:Path|str) -> Dict|List:
+    with open(fp, mode="r") as fh:
+        return json.load(fh)
+
 def write_str(fp:Path|str, data:str) -> None:
     with open(fp, mode="w") as fh:
         fh.write(data)
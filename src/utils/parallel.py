@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from collections import deque
+from typing import Callable, Iterable, Iterator, Tuple, TypeVar, Deque, Dict, List, Sequence, Any
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def thread_map_bounded(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    nworkers: int,
+    max_pending: int|None = None
+) -> Iterator[Tuple[T, R|None, Exception|None]]:
+    """
+    run `func` on all `items` in a pool of `nworkers` threads and yield the results in the same order as `items`.
+
+    at most `max_pending` items are submitted to the pool at once: `items` is only consumed as results are
+    yielded, so that if `items` is a generator, the memory used stays capped.
+    errors are not raised: they are yielded alongside each item, so that a failure does not stop the other items.
+
+    :param func: the function to run on each item
+    :param items: the items
+    :param nworkers: number of threads
+    :param max_pending: maximum number of items submitted at once. defaults to `2*nworkers`
+    :yields: (item, result, None) if `func(item)` succeeded, (item, None, error) otherwise
+    """
+    if nworkers < 1:
+        raise ValueError(f"invalid value for 'nworkers': expected an int >= 1, got '{nworkers}'")
+    max_pending = 2*nworkers if max_pending is None else max(max_pending, 1)
+
+    def collect(item: T, future: Future) -> Tuple[T, R|None, Exception|None]:
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            return item, None, e
+
+    pending: Deque[Tuple[T, Future]] = deque()
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        for item in items:
+            if len(pending) >= max_pending:
+                yield collect(*pending.popleft())
+            pending.append((item, executor.submit(func, item)))
+        while len(pending):
+            yield collect(*pending.popleft())
+
+
+def process_map_summaries(
+    func: Callable[..., Dict[str, Any]],
+    args: Sequence[Tuple[Any, ...]],
+    nprocesses: int,
+    on_error: Callable[[Tuple[Any, ...]], Dict[str, Any]],
+    header: Callable[[List[Dict[str, Any]]], str],
+    describe: Callable[[Dict[str, Any]], str|None]
+) -> List[Dict[str, Any]]:
+    """
+    run `func(*a)` for each `a` in `args` in a pool of `nprocesses` worker processes, and print a summary of the runs.
+    if `nprocesses <= 1` or there is a single run, the runs are done in the current process.
+
+    `func` must be defined at module level (so that it can be run in a worker process) and return a summary of its run.
+    a run that fails does not stop the others: its summary is `on_error(a)`, with the error under the "error" key.
+    `SystemExit` is caught too, since invalid parameters exit (see `validate_pretty`).
+
+    :param func: the function to run
+    :param args: the positional arguments of each run
+    :param nprocesses: number of worker processes
+    :param on_error: the summary of a failed run, from its arguments
+    :param header: the first line of the printed summary, from the summaries of all runs
+    :param describe: the printed line of each run, from its summary. if None, the run is not printed
+    :returns: the summary of each run, in the same order as `args`
+    """
+    summaries = []
+    if nprocesses <= 1 or len(args) == 1:
+        for a in args:
+            try:
+                summaries.append(func(*a))
+            except (Exception, SystemExit) as e:
+                summaries.append({ **on_error(a), "error": repr(e) })
+    else:
+        with ProcessPoolExecutor(max_workers=nprocesses) as executor:
+            futures = [ executor.submit(func, *a) for a in args ]
+            for a, future in zip(args, futures):
+                try:
+                    summaries.append(future.result())
+                except (Exception, SystemExit) as e:
+                    summaries.append({ **on_error(a), "error": repr(e) })
+
+    print(header(summaries))
+    for s in summaries:
+        line = describe(s)
+        if line is not None:
+            print(line)
+    return summaries
@@ -0,0 +1,119 @@
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Any, Iterator
+import threading
+import tracemalloc
+import time
+
+# pipeline stages, in processing order
+READ = "read"
+RESAMPLE = "resample"
+CHANNEL_CONVERSION = "channel conversion"
+CHUNK_POSITIONING = "chunk positioning"
+ENVELOPE = "envelope"
+MIX = "mix"
+WRITE = "write"
+STAGES = [ READ, RESAMPLE, CHANNEL_CONVERSION, CHUNK_POSITIONING, ENVELOPE, MIX, WRITE ]
+
+
+class Profiler:
+
+    def __init__(self):
+        """
+        record the wall time and peak memory of each pipeline stage.
+
+        a stage can run many times (once per chunk, per batch...): its calls are aggregated by stage name.
+        stages can be nested (the time and memory of a nested stage are also counted in its parent) and can run
+        in worker threads (the time of concurrent calls is summed, so it can be higher than the wall time,
+        and the peak memory of concurrent calls is approximate: `tracemalloc` traces all threads at once).
+
+        memory is measured with `tracemalloc`, which traces numpy allocations. the peak memory of a stage
+        is the highest amount of memory allocated during one of its calls, relative to the start of the call.
+        NOTE: the pages of a memory-mapped file that are read from disk are not allocations, and are not traced.
+        """
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()  # stack of running stages, per thread
+        self.t0 = 0.
+        self.peak = 0  # peak memory of the whole run. `reset_peak` is called by each stage, so it is tracked separately
+
+    def start(self) -> "Profiler":
+        tracemalloc.start()
+        self.t0 = time.perf_counter()
+        return self
+
+    def stop(self) -> Dict[str, Any]:
+        """stop profiling and return the report (see `Profiler.report`)"""
+        report = self.report()
+        tracemalloc.stop()
+        return report
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """time and trace the memory of the code run inside the context, as part of stage `name`"""
+        stack: List[Dict] = self.local.__dict__.setdefault("stack", [])
+        if len(stack):
+            # `reset_peak` forgets the peak of the parent stage: it is saved first
+            stack[-1]["peak"] = max(stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        current = { "mem0": tracemalloc.get_traced_memory()[0], "peak": 0 }
+        stack.append(current)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - t0
+            peak = max(current["peak"], tracemalloc.get_traced_memory()[1])
+            stack.pop()
+            if len(stack):
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            with self.lock:
+                self.peak = max(self.peak, peak)
+                record = self.stages.setdefault(name, { "calls": 0, "time": 0., "peak_memory": 0 })
+                record["calls"] += 1
+                record["time"] += duration
+                record["peak_memory"] = max(record["peak_memory"], peak - current["mem0"])
+
+    def report(self) -> Dict[str, Any]:
+        """
+        :returns: { "wall_time": <seconds>, "peak_memory": <bytes>, "stages": { <stage>: { "calls", "time", "peak_memory" } } }
+            stages are sorted in processing order (see `STAGES`)
+        """
+        order = { s: i for i, s in enumerate(STAGES) }
+        return {
+            "wall_time": time.perf_counter() - self.t0,
+            "peak_memory": max(self.peak, tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0),
+            "stages": dict(sorted(self.stages.items(), key=lambda s: order.get(s[0], len(order))))
+        }
+
+
+_profiler: Profiler|None = None  # the active profiler, if profiling is enabled
+_nullcontext = nullcontext()
+
+
+def stage(name: str):
+    """
+    context manager that records stage `name` in the active profiler.
+    if profiling is disabled, it does nothing.
+
+    >>> with stage(READ):
+    ...     track = Track.read(fp)
+    """
+    if _profiler is None:
+        return _nullcontext
+    return _profiler.stage(name)
+
+
+def start_profiling() -> Profiler:
+    global _profiler
+    _profiler = Profiler().start()
+    return _profiler
+
+
+def stop_profiling() -> Dict[str, Any]:
+    """stop profiling and return the report of the active profiler (see `Profiler.report`)"""
+    global _profiler
+    if _profiler is None:
+        raise ValueError("profiling is not enabled. run `start_profiling` first")
+    report = _profiler.stop()
+    _profiler = None
+    return report
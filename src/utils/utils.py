@@ -1,5 +1,4 @@
-from typing import List
-import random
+from typing import List, Tuple
 
 import numpy as np
 from numpy.typing import NDArray
@@ -32,6 +31,13 @@ def get_chunk_ends(chunk_starts: NDArray, chunk_lengths: NDArray) -> NDArray:
     """
     return np.sum([chunk_starts, chunk_lengths], axis=0)
 
+def lengths_to_offsets(lengths: NDArray) -> NDArray:
+    """
+    from a 1D-array of N lengths, return the N+1 offsets of each item in a flat buffer:
+    the item `i` is at `buffer[offsets[i]:offsets[i+1]]`
+    """
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
 def trailing_zeroes(i:int, total:int)-> str:
     """
     in an iterator of size `total`, at iteration `i`, return a pretty-printed string indicating the iteration number with trailing `0`:
@@ -42,8 +48,69 @@ def trailing_zeroes(i:int, total:int)-> str:
     num_zeroes = len(str(total)) - len(str(i))
     return f"{'0'*num_zeroes}{i}"
 
-def get_random_item(l: List):
-    return random.choice(l)
+def to_dtype(data: NDArray, dtype: np.dtype|type) -> NDArray:
+    """
+    convert `data` to `dtype`. if `dtype` is an integer type, values are rounded
+    and clipped to the range of `dtype` to avoid overflows.
+    """
+    dtype = np.dtype(dtype)
+    if data.dtype == dtype:
+        return data
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        if not np.issubdtype(data.dtype, np.integer):
+            data = np.rint(data)
+        data = np.clip(data, info.min, info.max)
+    return data.astype(dtype)
+
+def full_scale(dtype: np.dtype|type) -> Tuple[float, float]:
+    """
+    return the full-scale amplitude and the offset of silence of a sample format:
+    - float: samples are in range -1..1, silence is 0
+    - signed int: samples are in range -2**(bits-1)..2**(bits-1)-1, silence is 0
+    - unsigned int (8-bit wav): samples are in range 0..2**bits-1, silence is 2**(bits-1)
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return 1., 0.
+    elif np.issubdtype(dtype, np.signedinteger):
+        return float(2 ** (dtype.itemsize*8 - 1)), 0.
+    elif np.issubdtype(dtype, np.unsignedinteger):
+        return float(2 ** (dtype.itemsize*8 - 1)), float(2 ** (dtype.itemsize*8 - 1))
+    raise ValueError(f"unsupported sample format: '{dtype}'")
+
+def convert_format(data: NDArray, from_dtype: np.dtype|type, to_dtype_: np.dtype|type) -> NDArray:
+    """
+    convert `data`, whose values are expressed in the scale of sample format `from_dtype`,
+    to sample format `to_dtype_` (for example, int16 data in range -32768..32767 to float32 data in range -1..1).
+    """
+    from_dtype, to_dtype_ = np.dtype(from_dtype), np.dtype(to_dtype_)
+    (scale_in, offset_in), (scale_out, offset_out) = full_scale(from_dtype), full_scale(to_dtype_)
+    if scale_in != scale_out or offset_in != offset_out:
+        data = (data - offset_in) * (scale_out / scale_in) + offset_out
+    return to_dtype(data, to_dtype_)
+
+# a seed, a seed sequence or a generator: anything accepted by `np.random.default_rng`
+Seed = int|np.random.SeedSequence|np.random.Generator|None
+
+def make_rng(seed: Seed = None) -> np.random.Generator:
+    """
+    return a random generator. if `seed` is a generator, it is returned as is, so that
+    a single generator can be threaded through all functions. if `seed` is None, the generator is seeded randomly.
+    """
+    return np.random.default_rng(seed)
+
+def spawn_seeds(seed: int|np.random.SeedSequence|None, n: int) -> List[np.random.SeedSequence]:
+    """
+    derive `n` independent seeds from `seed`, one for each parallel worker: each worker
+    creates its own generator from its seed (see `make_rng`), and draws from an independent stream.
+    the streams only depend on `seed` and on the position of the worker, not on the number of processes.
+    """
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return seed.spawn(n)
+
+def get_random_item(l: List, rng: np.random.Generator):
+    return l[rng.integers(len(l))]
 
 def array_plot(a: np.ndarray, title: str|None = None, xlabel: str|None = None, ylabel: str|None = None):
     try:
@@ -2,7 +2,43 @@ import operator
 from pathlib import Path
 from typing import List, Any, Literal, Callable
 
-ALLOWED_OPS = ["eq","gt","ge","lt","le"]
+OPS = {
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "eq": operator.eq,
+    "lt": operator.lt,
+    "le": operator.le,
+}
+ALLOWED_OPS = list(OPS.keys())
+
+
+class ValidationExit(SystemExit):
+    """
+    raised by `validate_pretty` when a parameter is invalid: the program exits with status 1, as with `exit(1)`.
+    `message` describes the invalid parameter, for callers that catch it instead of exiting (see `src.serve`)
+    """
+    def __init__(self, message: str):
+        super().__init__(1)
+        self.message = message
+
+# inputs are validated at API boundaries (`Split`, `Splice`, `Envelope.from_dict`...). internal callers that
+# pass inputs that are valid by construction skip validation (`validate_off=True`), unless strict mode is enabled.
+_strict = False
+
+def set_strict(strict: bool) -> None:
+    """
+    enable or disable strict mode. in strict mode, inputs are validated everywhere, even in internal calls
+    that are trusted to be valid: slower, but useful to debug.
+    """
+    global _strict
+    _strict = strict
+
+def is_strict() -> bool:
+    return _strict
+
+def should_validate(validate_off: bool) -> bool:
+    """check if the inputs of a function should be validated, given its `validate_off` flag and strict mode"""
+    return not validate_off or _strict
 
 def validate_points(role: str, p:int):
     if not isinstance(p, float):
@@ -23,15 +59,9 @@ def validate_type(i, type_) -> Any:
 
 def validate_comparison(opname: Literal["eq","gt","ge","lt","le"], a:Any,b:Any) -> None:
     """general function to ensure that a and b validate a certain comparison (a<b...)"""
-    if opname not in ALLOWED_OPS:
+    op = OPS.get(opname)
+    if op is None:
         raise ValueError(f"invalid value for 'op': '{opname}'. expected one of '{ALLOWED_OPS}'")
-    op = {
-        "gt": operator.gt,
-        "ge": operator.ge,
-        "eq": operator.eq,
-        "lt": operator.lt,
-        "le": operator.le,
-    }[opname]
     if not op(a, b):
         raise ValueError(f"failed comparison: expected a '{opname}' b (a={a}, b={b})")
 
@@ -46,9 +76,9 @@ def validate_isinrange(
     inclusive: bool=False
 ) -> None:
     valid = (
-       (i >= min_ or i <= max_)
+       min_ <= i <= max_
        if inclusive
-       else (i < min_ or i > max_)
+       else min_ < i < max_
     )
     if not valid:
         raise ValueError(f"invalid value: should be in range ({min_},{max_}), got '{i}' (inclusive bounds: {inclusive})")
@@ -73,5 +103,6 @@ def validate_pretty(param_name: str, validate_func: Callable, *args, **kwargs):
     try:
         return validate_func(*args, **kwargs)
     except Exception as e:
+        message = f"error validating parameter {param_name}: {getattr(e, 'message', repr(e))}"
         print(f"error validating parameter {param_name}. exiting... {getattr(e, 'message', repr(e))}")
-        exit(1)
+        raise ValidationExit(message) from e